@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+This is the extraction_throughput benchmark, showing how the parallel PDF
+text extraction scales with the number of worker processes. Run it from the
+repository root:
+
+    python -m benchmarks.extraction_throughput [--files 200] [--pages 20] [DIR]
+
+Without a directory, synthetic PDFs are generated in a temporary directory.
+"""
+import argparse
+import sys
+from glob import glob
+from os import cpu_count
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import extraction
+
+
+def make_pdfs(directory: str, file_count: int, page_count: int) -> list:
+    """
+    Writes synthetic PDF files full of text into the given directory.
+
+    Returns:
+        list: the paths of the created files
+    """
+    import fitz
+
+    paths = []
+    text = "TrueName extraction benchmark, lorem ipsum dolor sit amet. " * 40
+    for number in range(file_count):
+        path = join(directory, f"document_{number}.pdf")
+        with fitz.open() as doc:
+            for _ in range(page_count):
+                doc.new_page().insert_textbox(fitz.Rect(36, 36, 560, 800), text)
+            doc.save(path)
+        paths.append(path)
+    return paths
+
+
+def run(paths: list, max_workers: int) -> float:
+    """
+    Extracts all the given documents, and returns the elapsed time in seconds.
+    """
+    start = perf_counter()
+    errors = sum(1 for result in extraction.extract_texts(paths, max_workers) if result.error)
+    elapsed = perf_counter() - start
+    if errors:
+        print(f"  {errors} files failed to extract")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TrueName extraction benchmark")
+    parser.add_argument("directory", nargs="?", help="directory of PDF files to extract")
+    parser.add_argument("--files", type=int, default=200, help="synthetic files to generate")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic file")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp_dir:
+        if args.directory:
+            paths = sorted(glob(join(args.directory, "**", "*.pdf"), recursive=True))
+        else:
+            print(f"Generating {args.files} PDFs of {args.pages} pages...")
+            paths = make_pdfs(tmp_dir, args.files, args.pages)
+
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= (cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+
+        baseline = None
+        print(f"{'workers':>8} {'seconds':>10} {'files/s':>10} {'speedup':>8}")
+        for max_workers in worker_counts:
+            elapsed = run(paths, max_workers)
+            baseline = baseline or elapsed
+            print(f"{max_workers:>8} {elapsed:>10.2f} {len(paths) / elapsed:>10.1f} {baseline / elapsed:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+This is the file_memory benchmark, measuring the memory used per File object
+in a large session. Run it from the repository root:
+
+    python -m benchmarks.file_memory [--files 100000] [--text-size 20000]
+
+The memory is measured with tracemalloc, for the File objects alone, then
+once their names are generated, their text content extracted and their
+embeddings computed (the text and embeddings themselves go to the spill
+store on disk, not in memory).
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from os.path import join
+
+import file
+
+
+def measure(step, *args) -> tuple:
+    """
+    Runs the given step and returns the memory it allocated, in bytes, and
+    its result.
+    """
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    result = step(*args)
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, result
+
+
+def create_files(file_count: int) -> list:
+    directory = join("C:\\", "Users", "someone", "Documents", "Scans", "2024")
+    return [file.File(join(directory, f"scan_{number:06d}.pdf")) for number in range(file_count)]
+
+
+def name_files(files: list) -> None:
+    for number, current_file in enumerate(files):
+        current_file.new_name = f"Quarterly report of the sales department {number}.pdf"
+        current_file.build_new_path()
+
+
+def fill_text(files: list, text: str) -> None:
+    for current_file in files:
+        current_file.text_content = text
+
+
+def fill_embeddings(files: list) -> None:
+    import numpy as np
+    import models
+
+    embedding = np.ones(models.EMBEDDING_DIM, dtype=np.float16)
+    for current_file in files:
+        current_file.embedding = embedding
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TrueName File memory benchmark")
+    parser.add_argument("--files", type=int, default=100000, help="number of File objects")
+    parser.add_argument("--text-size", type=int, default=20000,
+                        help="characters of text content per file (0 to skip)")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    created, files = measure(create_files, args.files)
+    named, _ = measure(name_files, files)
+    print(f"File objects:        {created / args.files:8.0f} bytes per file")
+    print(f"+ new names, paths:  {named / args.files:8.0f} bytes per file")
+
+    if args.text_size > 0:
+        text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (args.text_size // 57 + 1)
+        spilled, _ = measure(fill_text, files, text[:args.text_size])
+        print(f"+ {args.text_size} chars of text: {spilled / args.files:8.0f} bytes per file in memory")
+
+    embedded, _ = measure(fill_embeddings, files)
+    print(f"+ embeddings:        {embedded / args.files:8.0f} bytes per file in memory")
+
+    total = tracemalloc.get_traced_memory()[0]
+    print(f"Total:               {total / args.files:8.0f} bytes per file")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
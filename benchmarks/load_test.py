@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+This is the load_test benchmark, simulating production-scale folders to see
+how TrueName behaves on 10k-100k files. Run it from the repository root:
+
+    python -m benchmarks.load_test --files 10000 [--mode core|gui|both]
+
+It synthesizes a directory tree with a configurable mix of PDF files (sizes,
+page counts, metadata titles) and images (resolutions, EXIF data), including
+duplicates and files bound to get the same name. It then drives the full
+add -> generate -> rename -> revert cycle, through the core File API and/or
+through TrueNameMainWindow (offscreen Qt platform), using tiny stand-in
+models. It reports throughput, latency percentiles, peak memory and, for the
+GUI, event loop stalls.
+"""
+import argparse
+import sys
+from os import environ, makedirs
+from os.path import join
+from random import Random
+from shutil import copyfile
+from tempfile import TemporaryDirectory
+from threading import Thread, Event
+from time import perf_counter
+
+# Must be set before the TrueName modules are imported
+environ.setdefault("TRUENAME_FLAN_MODEL", "google/t5-efficient-tiny")
+environ.setdefault("TRUENAME_BLIP_MODEL", "hf-internal-testing/tiny-random-BlipForConditionalGeneration")
+environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+LOREM = (
+    "Invoice quarterly report meeting minutes contract amendment holiday "
+    "photos budget forecast research paper lecture notes tax statement "
+).split()
+
+# Stall threshold of the GUI event loop (seconds)
+STALL_THRESHOLD = 0.1
+TIMER_INTERVAL_MS = 10
+
+
+class MemorySampler(Thread):
+    """
+    Samples the resident memory of this process and its children (the
+    extraction workers) in the background, keeping the peak.
+    """
+    def __init__(self, interval: float = 0.05) -> None:
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = Event()
+
+    def run(self) -> None:
+        import psutil
+
+        process = psutil.Process()
+        while not self._stop_event.is_set():
+            try:
+                rss = process.memory_info().rss
+                for child in process.children(recursive=True):
+                    rss += child.memory_info().rss
+            except psutil.Error:
+                continue
+            self.peak = max(self.peak, rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        """
+        Stops sampling and returns the peak memory in bytes.
+        """
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def percentiles(values: list) -> str:
+    """
+    Formats the p50, p90, p99 and max of the given latencies (seconds).
+    """
+    if not values:
+        return "n/a"
+    values = sorted(values)
+
+    def pick(ratio):
+        return values[min(len(values) - 1, int(ratio * len(values)))] * 1000
+
+    return (f"p50 {pick(0.5):.1f} ms, p90 {pick(0.9):.1f} ms, "
+            f"p99 {pick(0.99):.1f} ms, max {values[-1] * 1000:.1f} ms")
+
+
+def synthesize_tree(root: str, args) -> list:
+    """
+    Writes the synthetic files into nested directories under root.
+
+    Returns:
+        list: the paths of the created files
+    """
+    import fitz
+    from PIL import Image
+
+    rng = Random(args.seed)
+    page_counts = [int(count) for count in args.pdf_pages.split(",")]
+    resolutions = [tuple(int(side) for side in size.split("x")) for size in args.image_sizes.split(",")]
+    # A few contents shared by many files, bound to get the same name
+    colliding_texts = [" ".join(rng.choices(LOREM, k=200)) for _ in range(5)]
+
+    paths = []
+    for number in range(args.files):
+        directory = join(root, f"dir_{number % args.dirs:03d}", f"sub_{number % 7}")
+        makedirs(directory, exist_ok=True)
+
+        # Exact duplicates of earlier files
+        if paths and rng.random() < args.duplicate_ratio:
+            source = rng.choice(paths)
+            path = join(directory, f"copy_{number}{source[source.rindex('.'):]}")
+            copyfile(source, path)
+            paths.append(path)
+            continue
+
+        if rng.random() < args.pdf_ratio:
+            path = join(directory, f"scan_{number}.pdf")
+            if rng.random() < args.collision_ratio:
+                text = rng.choice(colliding_texts)
+            else:
+                text = " ".join(rng.choices(LOREM, k=300))
+            with fitz.open() as doc:
+                for _ in range(rng.choice(page_counts)):
+                    doc.new_page().insert_textbox(fitz.Rect(36, 36, 560, 800), text)
+                if rng.random() < args.metadata_ratio:
+                    doc.set_metadata({"title": " ".join(rng.choices(LOREM, k=4)).title()})
+                doc.save(path)
+        else:
+            path = join(directory, f"IMG_{number}.jpg")
+            width, height = rng.choice(resolutions)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            image = Image.new("RGB", (width, height), color)
+            exif = Image.Exif()
+            if rng.random() < args.metadata_ratio:
+                exif[0x0132] = f"2023:0{rng.randint(1, 9)}:1{rng.randint(0, 9)} 12:00:00"
+                exif[0x0110] = "LoadTest Camera"
+            image.save(path, quality=85, exif=exif)
+        paths.append(path)
+    return paths
+
+
+def run_core(paths: list) -> dict:
+    """
+    Runs the add -> generate -> rename -> revert cycle through the core File
+    API, and returns the timings.
+    """
+    import extraction
+    import file
+    import metadata
+    from clean_filename import dynamic_rename
+
+    timings = {}
+    start = perf_counter()
+    files = [file.File(path) for path in paths]
+    text_files = [f for f in files if f.file_type.lower() in file.file_formats["text_formats"]]
+    for f in files:
+        if f.file_type.lower() in file.file_formats["image_formats"]:
+            f.extract_image_content()
+    results = extraction.extract_texts([f.original_path for f in text_files])
+    for text_file, result in zip(text_files, results):
+        text_file.set_extraction_result(result)
+    file.tokenize_files(text_files)
+    timings["add"] = perf_counter() - start
+
+    latencies = []
+    metadata_hits = 0
+    start = perf_counter()
+    for number, current_file in enumerate(files, 1):
+        file_start = perf_counter()
+        if metadata.METADATA_FIRST and current_file.name_from_metadata():
+            metadata_hits += 1
+        else:
+            current_file.process_file(number)
+        latencies.append(perf_counter() - file_start)
+    timings["generate"] = perf_counter() - start
+    timings["latencies"] = latencies
+    timings["metadata_hits"] = metadata_hits
+
+    start = perf_counter()
+    renamed = [f for f in files if f.new_path != ""]
+    collisions = 0
+    for current_file in renamed:
+        # dynamic_rename adds a "_(n)" suffix to colliding names, and
+        # returns the path actually used
+        renamed_path = dynamic_rename(current_file.original_path, current_file.new_path)
+        if renamed_path != current_file.new_path:
+            collisions += 1
+            current_file.new_path = renamed_path
+    timings["rename"] = perf_counter() - start
+    timings["collisions"] = collisions
+
+    start = perf_counter()
+    reverted = 0
+    for current_file in renamed:
+        try:
+            dynamic_rename(current_file.new_path, current_file.original_path)
+            reverted += 1
+        except OSError:
+            pass
+    timings["revert"] = perf_counter() - start
+    timings["not_reverted"] = len(renamed) - reverted
+    return timings
+
+
+def run_gui(paths: list) -> dict:
+    """
+    Runs the add -> generate -> rename -> revert cycle through the main
+    window, and returns the timings and event loop stalls.
+    """
+    from PyQt6.QtCore import QEventLoop, QTimer
+    from PyQt6.QtWidgets import QApplication
+    import main_window
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    # The progress window redirects sys.stdout into its log, restored below
+    # so the report reaches the terminal
+    stdout = sys.stdout
+    try:
+        window = main_window.TrueNameMainWindow()
+        window.show()
+        # Normally started by the event loop once the window is shown
+        window.warm_up_thread.start()
+        window.warm_up_thread.wait()
+
+        # Measuring the gaps between the ticks of a fast timer: any gap longer
+        # than the interval is time the event loop couldn't run
+        stalls = []
+        last_tick = [perf_counter()]
+
+        def tick():
+            now = perf_counter()
+            gap = now - last_tick[0]
+            if gap > STALL_THRESHOLD:
+                stalls.append(gap)
+            last_tick[0] = now
+
+        timer = QTimer()
+        timer.timeout.connect(tick)
+        timer.start(TIMER_INTERVAL_MS)
+
+        # The file dialog answers with the synthetic files
+        main_window.QFileDialog.getOpenFileNames = staticmethod(lambda *args, **kwargs: (paths, ""))
+
+        # Generation and renaming run in the background, through the core
+        # service: the event loop runs until they're finished
+        run_loop = QEventLoop()
+        window.run_finished.connect(run_loop.quit)
+
+        timings = {}
+        for step, action in (
+            ("add", window.open_dialog),
+            ("generate", lambda: (window.source_files_list.selectAll(), window.generate_filenames())),
+            ("rename", lambda: (window.new_file_paths_list.selectAll(), window.rename_files())),
+            ("revert", window.revert_rename),
+        ):
+            last_tick[0] = perf_counter()
+            start = perf_counter()
+            action()
+            # Measuring the stall up to the end of the step
+            tick()
+            if window.bridge is not None:
+                run_loop.exec()
+            app.processEvents()
+            timings[step] = perf_counter() - start
+
+        timer.stop()
+    finally:
+        sys.stdout = stdout
+    timings["stalls"] = stalls
+    return timings
+
+
+def report(name: str, file_count: int, timings: dict, peak_memory: int) -> None:
+    print(f"\n=== {name} ({file_count} files) ===")
+    for step in ("add", "generate", "rename", "revert"):
+        elapsed = timings[step]
+        print(f"{step:>9}: {elapsed:9.2f} s  {file_count / elapsed if elapsed else 0:10.1f} files/s")
+    if "latencies" in timings:
+        print(f"Per-file generation latency: {percentiles(timings['latencies'])}")
+        print(f"Named from metadata: {timings['metadata_hits']}/{file_count}")
+        print(f"Name collisions (renamed with a suffix): {timings['collisions']}")
+        print(f"Renames not reverted: {timings['not_reverted']}")
+    if "stalls" in timings:
+        stalls = timings["stalls"]
+        print(f"Event loop stalls > {STALL_THRESHOLD * 1000:.0f} ms: {len(stalls)}, "
+              f"total {sum(stalls):.2f} s, {percentiles(stalls)}")
+    print(f"Peak memory (with workers): {peak_memory / 1024 ** 2:.0f} MB")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TrueName load test")
+    parser.add_argument("--files", type=int, default=10000, help="number of files to synthesize")
+    parser.add_argument("--mode", choices=("core", "gui", "both"), default="both")
+    parser.add_argument("--dirs", type=int, default=50, help="number of top-level directories")
+    parser.add_argument("--pdf-ratio", type=float, default=0.6, help="ratio of PDF files")
+    parser.add_argument("--pdf-pages", default="1,2,5,20,100", help="page counts to pick from")
+    parser.add_argument("--image-sizes", default="320x240,1280x720,4000x3000",
+                        help="image resolutions to pick from")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.05, help="ratio of exact copies")
+    parser.add_argument("--collision-ratio", type=float, default=0.1,
+                        help="ratio of PDFs sharing a content (same generated name)")
+    parser.add_argument("--metadata-ratio", type=float, default=0.3,
+                        help="ratio of files with a usable title or EXIF data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with TemporaryDirectory(prefix="truename_load_") as root:
+        # Keeping the session state of the test out of the user's
+        environ["TRUENAME_STATE_DIR"] = join(root, "state")
+
+        runs = []
+        if args.mode in ("core", "both"):
+            runs.append(("Core File API", run_core))
+        if args.mode in ("gui", "both"):
+            runs.append(("GUI (offscreen)", run_gui))
+
+        for index, (name, run) in enumerate(runs):
+            # Each run gets a fresh copy of the tree (same seed, same files)
+            print(f"Synthesizing {args.files} files...")
+            start = perf_counter()
+            paths = synthesize_tree(join(root, f"data_{index}"), args)
+            print(f"Done in {perf_counter() - start:.1f} s")
+
+            sampler = MemorySampler()
+            sampler.start()
+            timings = run(paths)
+            report(name, len(paths), timings, sampler.stop())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
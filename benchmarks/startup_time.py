@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+This is the startup_time benchmark, used to guard the application startup
+against regressions. Run it from the repository root:
+
+    python -m benchmarks.startup_time [--max-ms 1000]
+
+It reports the import time of each module imported by main_window (using
+`python -X importtime`), checks that none of the heavy modules are imported
+at startup, and measures the time until the main window is shown.
+Exits with status 1 if any check fails.
+"""
+import argparse
+import subprocess
+import sys
+from os import environ
+
+# These must only be imported lazily, once the window is displayed
+HEAVY_MODULES = ("torch", "transformers", "fitz", "PIL")
+
+SHOW_WINDOW_SCRIPT = """
+from time import perf_counter
+start = perf_counter()
+import sys
+from PyQt6.QtWidgets import QApplication
+import main_window
+app = QApplication(sys.argv)
+window = main_window.TrueNameMainWindow()
+window.show()
+app.processEvents()
+# The progress window redirects sys.stdout into its log
+print(f"{(perf_counter() - start) * 1000:.1f}", file=sys.__stdout__, flush=True)
+# Not waiting for the models warm-up thread
+import os
+os._exit(0)
+"""
+
+
+def measure_imports() -> list:
+    """
+    Imports main_window in a fresh interpreter with -X importtime.
+
+    Returns:
+        list: (cumulative_us, self_us, module_name) tuples, one per module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main_window"],
+        capture_output=True, text=True, check=True
+    )
+    timings = []
+    for line in result.stderr.splitlines():
+        # Format: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return timings
+
+
+def measure_window_shown() -> float:
+    """
+    Starts a fresh interpreter (offscreen Qt platform) and returns the time
+    in milliseconds until the main window is shown.
+    """
+    env = dict(environ, QT_QPA_PLATFORM="offscreen")
+    result = subprocess.run(
+        [sys.executable, "-c", SHOW_WINDOW_SCRIPT],
+        capture_output=True, text=True, check=True, env=env
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="TrueName startup benchmark")
+    parser.add_argument("--max-ms", type=float, default=1000,
+                        help="maximum time until the window is shown")
+    parser.add_argument("--top", type=int, default=15,
+                        help="number of slowest modules to list")
+    args = parser.parse_args()
+
+    failed = False
+    timings = measure_imports()
+
+    print("Slowest imports (cumulative, self) in ms:")
+    for cumulative_us, self_us, name in sorted(timings, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f} {self_us / 1000:10.1f}  {name}")
+
+    imported = {name.strip() for _, _, name in timings}
+    for module in HEAVY_MODULES:
+        if module in imported:
+            print(f"FAIL: {module} is imported at startup")
+            failed = True
+
+    elapsed_ms = measure_window_shown()
+    print(f"Window shown after {elapsed_ms:.1f} ms (max {args.max_ms:.0f} ms)")
+    if elapsed_ms > args.max_ms:
+        print("FAIL: startup is too slow")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,8 +6,8 @@ cause issues with future file manipulation.
 
 from unicodedata import normalize, category
 from re import sub
-from os import rename
-from os.path import splitext, join
+from os import rename, makedirs, link, remove
+from os.path import splitext, join, dirname, exists, samefile
 
 
 def clean_unicode(filename: str):
@@ -47,23 +47,50 @@ def secure_filename(filename: str):
     unicode_cleaned_filename = clean_unicode(filename)
     return clean_forbidden_chars(unicode_cleaned_filename)
 
-def dynamic_rename(src_path: str, dest_path: str):
+def rename_no_replace(src_path: str, dest_path: str):
     """
-    A modified os.rename that can create a dynamic file name if the new_path
-    file already exists.
+    Renames a file, raising FileExistsError if dest_path already exists, on
+    every platform: os.rename only does so on Windows, and silently replaces
+    the destination elsewhere.
+    The destination is claimed atomically with a hard link where the file
+    system supports them.
     """
+    if exists(dest_path):
+        # Renaming a file to itself, or changing the case of its name on a
+        # case-insensitive file system
+        if samefile(src_path, dest_path):
+            rename(src_path, dest_path)
+            return
+        raise FileExistsError(f"File exists: '{dest_path}'")
     try:
-        rename(src_path, dest_path)
+        link(src_path, dest_path)
     except FileExistsError:
-        successful = False
-        count = 1
-        while not successful:
-            file_root, file_ext = splitext(dest_path)
-            file_root += f"_({count})"
-            dynamic_path = file_root + file_ext
-            try:
-                rename(src_path, dynamic_path)
-                successful = True
-            except FileExistsError:
-                pass
+        raise
+    except OSError:
+        # No hard links on this file system (e.g. FAT), or across devices
+        rename(src_path, dest_path)
+        return
+    remove(src_path)
+
+
+def dynamic_rename(src_path: str, dest_path: str) -> str:
+    """
+    A modified os.rename that can create a dynamic file name if the new_path
+    file already exists, by adding a "_(n)" suffix. An existing file is never
+    replaced. The destination directory is created if needed.
+
+    Returns:
+        str: the path the file was actually renamed to
+    """
+    if dirname(dest_path) != "":
+        makedirs(dirname(dest_path), exist_ok=True)
+    file_root, file_ext = splitext(dest_path)
+    dynamic_path = dest_path
+    count = 1
+    while True:
+        try:
+            rename_no_replace(src_path, dynamic_path)
+            return dynamic_path
+        except FileExistsError:
+            dynamic_path = f"{file_root}_({count}){file_ext}"
             count += 1
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+This is the deadline module, used to bound the time spent on each file and
+on each batch of files. When a budget runs out, files fall back to cheaper
+ways of getting a name (greedy decoding, metadata) instead of stalling the
+whole batch.
+"""
+from time import monotonic
+
+
+# Time budget for the content extraction of a single file (seconds)
+EXTRACTION_TIME_BUDGET = 20.0
+# Images bigger than this are not decoded (pixels, after the reduced scale
+# decoding of JPEGs): a full decode could take longer than the extraction
+# time budget, and can't be interrupted
+IMAGE_MAX_PIXELS = 8000 * 5000
+# Time budget for the name generation of a single file (seconds)
+FILE_TIME_BUDGET = 60.0
+# Time budget of a whole batch of files, from the start of the batch
+# (extraction included): a fixed allowance of one file budget, plus this
+# many seconds per file on average. A batch running behind schedule gets
+# cheaper decoding, then metadata names.
+BATCH_TIME_PER_FILE = 20.0
+# Below this many seconds left, generation switches to greedy decoding
+FAST_GENERATION_BELOW = 15.0
+
+
+class Budget:
+    """
+    A time budget, started when created.
+
+    Attributes:
+        seconds (float): the total budget, None for an unlimited budget
+        parent (Budget): a budget this one is carved out of, if any
+    """
+    def __init__(self, seconds: float = None, parent=None) -> None:
+        self.seconds = seconds
+        self.parent = parent
+        self._start = monotonic()
+
+    def remaining(self) -> float:
+        """
+        Returns the seconds left (never negative), the parent budget
+        included. Unlimited budgets have float("inf") seconds left.
+        """
+        remaining = float("inf")
+        if self.seconds is not None:
+            remaining = max(0.0, self.seconds - (monotonic() - self._start))
+        if self.parent is not None:
+            remaining = min(remaining, self.parent.remaining())
+        return remaining
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def extend(self, seconds: float) -> None:
+        """
+        Adds the given seconds to the budget, e.g. for files added to a
+        running batch. Unlimited budgets stay unlimited.
+        """
+        if self.seconds is not None:
+            self.seconds += seconds
+
+    def child(self, seconds: float = None):
+        """
+        Returns a new budget of the given seconds, bounded by this one.
+        """
+        return Budget(seconds, parent=self)
+
+
+def batch_budget(file_count: int = 0) -> Budget:
+    """
+    Returns a new time budget for a batch of the given number of files, see
+    BATCH_TIME_PER_FILE. More files can be added with `Budget.extend`.
+    """
+    return Budget(FILE_TIME_BUDGET + file_count * BATCH_TIME_PER_FILE)
+
+
+def max_time(budget: Budget):
+    """
+    Returns the remaining seconds of the budget as a `max_time` value for
+    the models generate functions, None when unlimited.
+    """
+    remaining = budget.remaining()
+    return None if remaining == float("inf") else remaining
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+This is the extraction module, used to extract the text content of PDF files
+in parallel. Documents, and page ranges of very large documents, are spread
+across a pool of worker processes, each opening its own fitz handle.
+"""
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from os import cpu_count
+from os.path import getsize
+from time import monotonic
+from typing import Iterator, NamedTuple
+
+from session import bytes_hash, content_hash
+
+
+# Documents bigger than this are split into page ranges across workers
+LARGE_FILE_BYTES = 20 * 1024 * 1024
+PAGES_PER_CHUNK = 50
+
+# Below this many documents, the process pool startup costs more than it
+# saves, unless a timeout is set: only worker processes can be stopped
+PARALLEL_THRESHOLD = 4
+
+# Error message prefix of the documents taking longer than the timeout
+TIMEOUT_ERROR = "extraction timed out"
+
+
+class ExtractionResult(NamedTuple):
+    """
+    The text extracted from a document, or the error met while extracting it.
+
+    Attributes:
+        path (str): the path to the document
+        text (str): the extracted text, empty on error
+        error (str): the error message, empty on success
+        content_hash (str): the hash of the file bytes (see the session
+            module), computed while the file is read anyway, empty on error
+    """
+    path: str
+    text: str
+    error: str
+    content_hash: str = ""
+
+
+def extract_pages(path: str, start: int = 0, stop: int = None) -> str:
+    """
+    Extracts the text of the pages [start, stop) of the given document.
+    Runs in the worker processes, so errors are raised, not printed.
+
+    Args:
+        path (str): the path to the document
+        start (int): the first page to extract
+        stop (int): the page to stop at, or None for the last page
+
+    Returns:
+        str: the text of the pages, concatenated
+    """
+    import fitz
+
+    with fitz.open(path) as doc:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        return "".join(doc[number].get_text("text") for number in range(start, stop))
+
+
+def extract_document(path: str) -> tuple:
+    """
+    Extracts the text of the whole given document, reading the file only
+    once for both the text and the content hash. Runs in the worker
+    processes, so errors are raised, not printed.
+
+    Returns:
+        tuple: the (text, content hash) of the document
+    """
+    import fitz
+
+    with open(path, "rb") as f:
+        data = f.read()
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        text = "".join(page.get_text("text") for page in doc)
+    return text, bytes_hash(data)
+
+
+def extract_text(path: str) -> ExtractionResult:
+    """
+    Extracts the text of the given document in the current process.
+    """
+    try:
+        text, file_hash = extract_document(path)
+        return ExtractionResult(path, text, "", file_hash)
+    except Exception as e:
+        return ExtractionResult(path, "", str(e))
+
+
+def page_ranges(path: str) -> list:
+    """
+    Returns the page ranges to extract the given document with: a single
+    range for regular documents, chunks of PAGES_PER_CHUNK pages for very
+    large ones.
+    """
+    if getsize(path) <= LARGE_FILE_BYTES:
+        return [(0, None)]
+
+    import fitz
+
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    return [(start, start + PAGES_PER_CHUNK) for start in range(0, page_count, PAGES_PER_CHUNK)]
+
+
+def extract_texts(paths: list, max_workers: int = None, timeout: float = None) -> Iterator[ExtractionResult]:
+    """
+    Extracts the text of the given documents across a process pool, and
+    yields the results as a stream, in submission order. Errors are captured
+    per document in the results instead of being raised.
+
+    At most a few documents per worker are in flight at once, so memory
+    stays bounded when the caller consumes the stream slowly.
+
+    With a timeout, the stream never waits more than `timeout` seconds for a
+    document: a document taking longer gets a timeout error as its result,
+    and the worker processes are killed and replaced, so none keeps running
+    on it. Timeouts need worker processes, so the pool is used even for a
+    single document, trading a process start for never stalling on a
+    pathological file.
+
+    Args:
+        paths (list): the paths to the documents
+        max_workers (int): the number of worker processes, one per core by default
+        timeout (float): the time budget per document in seconds, None for no limit
+
+    Yields:
+        ExtractionResult: the result for each document, in the order of `paths`
+    """
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+
+    if not paths:
+        return
+
+    if timeout is None and (len(paths) < PARALLEL_THRESHOLD or max_workers == 1):
+        for path in paths:
+            yield extract_text(path)
+        return
+
+    max_in_flight = max_workers * 4
+    pool_size = min(max_workers, len(paths))
+    pool = ProcessPoolExecutor(max_workers=pool_size)
+    # (path, futures of its page ranges, or an error met before submitting)
+    pending = deque()
+    try:
+        for path in paths:
+            pending.append(_submit(pool, path))
+
+            while len(pending) >= max_in_flight:
+                result, pool = _next_result(pending, pool, pool_size, timeout)
+                yield result
+
+        while pending:
+            result, pool = _next_result(pending, pool, pool_size, timeout)
+            yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def kill_pool(pool) -> None:
+    """
+    Kills the worker processes of the given pool and shuts it down. A worker
+    stuck on a document can't be cancelled, and would otherwise keep running
+    until the document is done, holding up the interpreter exit meanwhile.
+    The running futures fail with BrokenProcessPool, the ones not started
+    yet are cancelled.
+    """
+    if hasattr(pool, "kill_workers"):
+        # Python 3.14+
+        pool.kill_workers()
+    else:
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(pool, path: str) -> tuple:
+    """
+    Submits a document to the pool, returns its entry in the pending queue.
+    """
+    try:
+        return (path, submit_document(pool, path), "")
+    except Exception as e:
+        return (path, [], str(e))
+
+
+def _next_result(pending: deque, pool, pool_size: int, timeout: float = None) -> tuple:
+    """
+    Collects the result of the first pending document. If it timed out, the
+    pool is killed and replaced, and the pending documents it didn't finish
+    are submitted again to the new pool.
+
+    Returns:
+        tuple: the ExtractionResult, and the pool to use from now on
+    """
+    result = _collect(*pending.popleft(), timeout)
+    if not result.error.startswith(TIMEOUT_ERROR):
+        return result, pool
+
+    kill_pool(pool)
+    pool = ProcessPoolExecutor(max_workers=pool_size)
+    for index, (path, futures, error) in enumerate(pending):
+        if not error and not all(map(_succeeded, futures)):
+            pending[index] = _submit(pool, path)
+    return result, pool
+
+
+def _succeeded(future) -> bool:
+    """
+    Returns True if the given future is done with a result. A future
+    cancelled by `kill_pool` raises CancelledError from `exception()`, so
+    it's checked first.
+    """
+    return future.done() and not future.cancelled() and future.exception() is None
+
+
+def submit_document(pool, path: str) -> list:
+    """
+    Submits the extraction of the given document to the pool.
+
+    Returns:
+        list: the futures of the extraction, see `_collect`
+    """
+    ranges = page_ranges(path)
+    if ranges == [(0, None)]:
+        return [pool.submit(extract_document, path)]
+    # The page ranges, then the content hash, read separately
+    return [pool.submit(extract_pages, path, start, stop) for start, stop in ranges] + [
+        pool.submit(content_hash, path)
+    ]
+
+
+def join_results(path: str, results: list) -> ExtractionResult:
+    """
+    Joins the results of the futures of a document (see `submit_document`)
+    into its ExtractionResult.
+    """
+    if len(results) == 1:
+        text, file_hash = results[0]
+        return ExtractionResult(path, text, "", file_hash)
+    return ExtractionResult(path, "".join(results[:-1]), "", results[-1])
+
+
+def timeout_result(path: str, timeout: float) -> ExtractionResult:
+    """
+    Returns the result of a document taking longer than the timeout.
+    """
+    return ExtractionResult(path, "", f"{TIMEOUT_ERROR} after {timeout:.0f} seconds")
+
+
+def _collect(path: str, futures: list, error: str, timeout: float = None) -> ExtractionResult:
+    """
+    Waits for the futures of a document (see `submit_document`), at most
+    `timeout` seconds in total, and joins them into its result.
+    """
+    if error:
+        return ExtractionResult(path, "", error)
+
+    deadline = None if timeout is None else monotonic() + timeout
+    try:
+        results = []
+        for future in futures:
+            remaining = None if deadline is None else max(0.0, deadline - monotonic())
+            results.append(future.result(timeout=remaining))
+        return join_results(path, results)
+    except TimeoutError:
+        # The ranges not started yet are dropped, the running ones are
+        # stopped by killing the pool (see `_next_result`)
+        for future in futures:
+            future.cancel()
+        return timeout_result(path, timeout)
+    except Exception as e:
+        return ExtractionResult(path, "", str(e))
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 """
-This the file module, containing the File class and the models used to process
-text and image files.
+This the file module, containing the File class used to process text and
+image files. The models themselves live in the models module, or in the model
+server process when one is running.
+
+fitz, PIL and torch are only imported when first needed, so importing this
+module stays cheap.
 """
+from itertools import count
 from os.path import splitext, join, dirname, normpath, basename
-import fitz
+from weakref import finalize
 from clean_filename import secure_filename
-from PIL import Image
-from transformers import BlipProcessor, BlipForConditionalGeneration
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
+import deadline
+import extraction
+import metadata
+import session
+import spill
+import models
+import model_server
 
 
 def clean_caption(caption):
@@ -30,16 +38,108 @@ def clean_caption(caption):
     return caption
 
 
-flan_tokenizer = AutoTokenizer.from_pretrained("google/flan-t5-large")
-blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-large")
+def run_on_backend(function_name: str, items: list, **options) -> list:
+    """
+    Runs the given generation function on the model server if one is
+    running, or falls back to the in-process models otherwise.
+
+    Args:
+        function_name (str): "generate_text_names" or "generate_image_captions"
+        items (list): the batch of inputs for the function
+        **options: keyword arguments of the function (max_time, fast)
+
+    Returns:
+        list: the models.Generation outputs, one per input
+    """
+    client = model_server.get_client()
+    if client is not None:
+        try:
+            return getattr(client, function_name)(items, **options)
+        except (EOFError, OSError) as e:
+            print(f"Error: {e} with the model server, loading models in-process")
+            model_server.reset_client()
+    return getattr(models, function_name)(items, **options)
+
+
+# Constant instruction prefix for the FLAN model, tokenized only once
+PROMPT = """Instruction: Generate a short descriptive filename for this text file.
+        Content:\n 
+        """
+
+# Upper bound of characters kept per token before tokenizing the content.
+# Only the first tokens fit in the model input anyway, so there is no point
+# in tokenizing a whole 500-page document.
+CHARS_PER_TOKEN_BOUND = 16
+
+_prompt_ids = None
+
+
+def get_prompt_ids() -> list:
+    """
+    Returns the token IDs of the constant prompt prefix, tokenizing it on
+    the first call only.
+    """
+    global _prompt_ids
+    if _prompt_ids is None:
+        _prompt_ids = models.get_flan_tokenizer()(PROMPT, add_special_tokens=False)["input_ids"]
+    return _prompt_ids
+
+
+def build_input_ids(content_ids: list) -> "torch.Tensor":
+    """
+    Concatenates the prompt prefix and the content token IDs at the ID level,
+    truncates the result to the model max length and appends the EOS token,
+    the same way the tokenizer would on the full "prompt + content" string.
+
+    Args:
+        content_ids (list): the token IDs of the text content (no special tokens)
+
+    Returns:
+        torch.Tensor: a (1, n) tensor of input IDs, ready for generation
+    """
+    import torch
+
+    flan_tokenizer = models.get_flan_tokenizer()
+    prompt_ids = get_prompt_ids()
+    room = flan_tokenizer.model_max_length - len(prompt_ids) - 1
+    input_ids = prompt_ids + content_ids[:room] + [flan_tokenizer.eos_token_id]
+    return torch.tensor([input_ids], dtype=torch.long)
+
+
+def tokenize_files(files: list) -> None:
+    """
+    Tokenizes the text content of the given File objects in one call to the
+    fast (Rust) tokenizer batch API, and caches the resulting input IDs next
+    to the extracted content (`input_ids` attribute).
+    Files without text content are left untouched.
+
+    Args:
+        files (list): the File objects to tokenize
+    """
+    files = [f for f in files if f.text_content != ""]
+    if not files:
+        return
+
+    flan_tokenizer = models.get_flan_tokenizer()
+    max_chars = flan_tokenizer.model_max_length * CHARS_PER_TOKEN_BOUND
+    texts = [f.text_content[:max_chars] for f in files]
+    encodings = flan_tokenizer(
+        texts,
+        add_special_tokens=False,
+        return_attention_mask=False
+    )["input_ids"]
+
+    for current_file, content_ids in zip(files, encodings):
+        current_file.input_ids = build_input_ids(content_ids)
+
 
-flan_model = AutoModelForSeq2SeqLM.from_pretrained("google/flan-t5-large", device_map="auto")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-large", device_map="auto")
+# Unique keys of the File objects contents in the spill store
+_spill_keys = count()
 
 
 file_formats = {
     "image_formats": ("png", "jpeg", "jpg", "webp"),
-    "text_formats": ("pdf")
+    "text_formats": ("pdf",)
 }
 
 class File:
@@ -47,15 +147,39 @@ class File:
     This is the File class, representing the file to manipulate and all the
     necessary information to rename it properly.
 
+    File objects are kept compact for sessions of 100k+ files: attributes are
+    stored in __slots__ (no per-instance __dict__), and the bulky contents
+    (text_content, image_content, input_ids, embedding) are kept out of the
+    object, in the spill store (see the spill module). The properties read and write
+    the spill store transparently. A File takes about 1 KB of memory, path
+    and new name included, as measured by `python -m benchmarks.file_memory`.
+
     Attributes:
         original_path (str): the path to the file to manipulate
         original_name (str): the name of the file without its extension
         file_type (str): the extension of the file
         text_content (str): the text content of the file if it's a text file
         image_content (PIL.Image): the raw image content of the file if it's an image
+        input_ids (torch.Tensor): the cached prompt + text content token IDs
         new_name (str): the new name of the file
         new_path (str): the new path of the file after renaming
+        error (str): the error met when extracting the content, if any
+        embedding (numpy.ndarray): compact embedding of the content, computed
+            during the name generation
+        folder (str): the proposed target subfolder, relative to the original
+            directory ("" to keep the file in place)
+        extracted (bool): whether the content extraction was attempted
+        fallback_reason (str): why the file wasn't named by the full model
+            generation (time budget, errors), "" if it was
     """
+    __slots__ = (
+        "_original_path", "_original_name", "_file_type", "_spill_key",
+        "_has_text", "_has_image", "_has_input_ids", "_has_embedding",
+        "_new_name", "_new_path",
+        "_error", "_folder", "_extracted", "_fallback_reason",
+        "_decode_steps", "_content_hash", "_finalizer",
+        "__weakref__"
+    )
 
     def __init__(self, file_path: str) -> None:
         """
@@ -80,10 +204,22 @@ class File:
         # NOTE Need to be careful with more exotic file extensions like .tar.gz or .JPG
         # Case-sensitive issues or bad splitting could happen
 
-        self._text_content: str = ""
-        self._image_content = None
+        # Contents are in the spill store, under this key, when the flags are set
+        self._spill_key: int = next(_spill_keys)
+        self._has_text: bool = False
+        self._has_image: bool = False
+        self._has_input_ids: bool = False
+        self._has_embedding: bool = False
+        # Deletes the contents from the spill store with the object
+        self._finalizer = None
         self._new_name: str = ""
         self._new_path: str = ""
+        self._error: str = ""
+        self._folder: str = ""
+        self._extracted: bool = False
+        self._fallback_reason: str = ""
+        self._decode_steps: int = 0
+        self._content_hash: str = ""
 
     @property
     def original_path(self) -> str:
@@ -111,19 +247,62 @@ class File:
 
     @property
     def text_content(self) -> str:
-        return self._text_content
+        if not self._has_text:
+            return ""
+        return spill.get_store().get_text(self._spill_key)
 
     @text_content.setter
     def text_content(self, value: str) -> None:
-        self._text_content = value
+        self._has_text = value != ""
+        if self._has_text:
+            self._spill().put_text(self._spill_key, value)
+        else:
+            self._unspill(spill.TEXT)
 
     @property
     def image_content(self):
-        return self._image_content
+        if not self._has_image:
+            return None
+        return spill.get_store().get_image(self._spill_key)
     
     @image_content.setter
     def image_content(self, value):
-        self._image_content = value
+        self._has_image = value is not None
+        if self._has_image:
+            self._spill().put_image(self._spill_key, value)
+        else:
+            self._unspill(spill.IMAGE)
+
+    @property
+    def input_ids(self):
+        if not self._has_input_ids:
+            return None
+        return spill.get_store().get_input_ids(self._spill_key)
+
+    @input_ids.setter
+    def input_ids(self, value) -> None:
+        self._has_input_ids = value is not None
+        if self._has_input_ids:
+            self._spill().put_input_ids(self._spill_key, value)
+        else:
+            self._unspill(spill.INPUT_IDS)
+
+    def _spill(self) -> spill.SpillStore:
+        """
+        Returns the spill store, making sure the contents of this object are
+        deleted from it when the object is.
+        """
+        store = spill.get_store()
+        if self._finalizer is None:
+            self._finalizer = finalize(self, store.delete, self._spill_key)
+        return store
+
+    def _unspill(self, kind: str) -> None:
+        """
+        Deletes the given kind of content of this object from the spill store.
+        """
+        if self._finalizer is not None:
+            spill.get_store().delete(self._spill_key, kind)
 
     @property
     def new_name(self) -> str:
@@ -142,81 +321,173 @@ class File:
     def new_path(self, value: str) -> None:
         self._new_path = value
 
+    @property
+    def error(self) -> str:
+        return self._error
+
+    @error.setter
+    def error(self, value: str) -> None:
+        self._error = value
+
+    @property
+    def embedding(self):
+        if not self._has_embedding:
+            return None
+        return spill.get_store().get_embedding(self._spill_key)
+
+    @embedding.setter
+    def embedding(self, value) -> None:
+        self._has_embedding = value is not None
+        if self._has_embedding:
+            self._spill().put_embedding(self._spill_key, value)
+        else:
+            self._unspill(spill.EMBEDDING)
+
+    @property
+    def folder(self) -> str:
+        return self._folder
+
+    @folder.setter
+    def folder(self, value: str) -> None:
+        # Same restrictions as a filename, the folder is a single path part
+        self._folder = secure_filename(value)
+
+    @property
+    def extracted(self) -> bool:
+        return self._extracted
+
+    @extracted.setter
+    def extracted(self, value: bool) -> None:
+        self._extracted = value
+
+    @property
+    def fallback_reason(self) -> str:
+        return self._fallback_reason
+
+    @fallback_reason.setter
+    def fallback_reason(self, value: str) -> None:
+        self._fallback_reason = value
+
+    @property
+    def decode_steps(self) -> int:
+        return self._decode_steps
+
+    @decode_steps.setter
+    def decode_steps(self, value: int) -> None:
+        self._decode_steps = value
+
+    @property
+    def content_hash(self) -> str:
+        return self._content_hash
+
+    @content_hash.setter
+    def content_hash(self, value: str) -> None:
+        self._content_hash = value
+
 
     def extract_text_content(self) -> None:
         """
         Extracts text content from the file at "original_path" and stores it
         in the "text_content" attribute.
-        If an error occurs when opening the file, text_content is set to an empty string.
+        If an error occurs when opening the file, text_content is set to an
+        empty string and the error is stored in the "error" attribute.
+        For many files at once, prefer `extraction.extract_texts` and
+        `set_extraction_result`.
         """
-        text = ""
-        try:
-            with fitz.open(self.original_path) as doc:
-                pages_text_list = []
-                for page in doc:
-                    pages_text_list.append(page.get_text("text"))
-                text = "".join(pages_text_list)
-
-        except Exception as e:
-            print(f"Error: {e} when opening file at path [{self.original_path}]")
-            text = ""
+        self.set_extraction_result(extraction.extract_text(self.original_path))
 
-        self.text_content = text
+    def set_extraction_result(self, result) -> None:
+        """
+        Stores the given extraction.ExtractionResult of this file.
+        """
+        if result.error:
+            print(f"Error: {result.error} when opening file at path [{self.original_path}]")
+        self.text_content = result.text
+        self.error = result.error
+        self.content_hash = result.content_hash
+        self.extracted = True
+        # Cached token IDs belong to the previous content
+        self.input_ids = None
+
+    def tokenize_text_content(self) -> None:
+        """
+        Tokenizes the text content and caches the input IDs in the `input_ids`
+        attribute. Prefer `tokenize_files` for several files at once.
+        """
+        tokenize_files([self])
 
     def extract_image_content(self) -> None:
         """
         Extracts and returns raw image content from the file at "original_path".
-        If an error occurs when opening the image, image_content is set to None.
+        If an error occurs when opening the image, or if it's bigger than
+        deadline.IMAGE_MAX_PIXELS, image_content is set to None and the error
+        is stored in the "error" attribute.
+        The file is read only once, for both the image and its content hash.
         """
+        from io import BytesIO
+        from PIL import Image
+
+        self.extracted = True
+        self.content_hash = ""
         try:
             with open(self.original_path, 'rb') as file:
-                self.image_content = Image.open(file).convert('RGB')
+                data = file.read()
+            self.content_hash = session.bytes_hash(data)
+            image = Image.open(BytesIO(data))
+            # Decoding huge JPEGs directly at a reduced scale, much faster
+            image.draft('RGB', (spill.IMAGE_MAX_SIDE, spill.IMAGE_MAX_SIDE))
+            # Other formats are decoded in full, not bounded by the time
+            # budget: too large images are left to the metadata fallback
+            width, height = image.size
+            if width * height > deadline.IMAGE_MAX_PIXELS:
+                raise ValueError(f"image too large to decode ({width}x{height} pixels)")
+            self.image_content = image.convert('RGB')
+            self.error = ""
         except Exception as e:
             self.image_content = None
+            self.error = str(e)
             print(f"Error : {e} when opening image at path [{self.original_path}]")
 
-    def generate_text_name(self) -> None:
+    def generate_text_name(self, max_time: float = None, fast: bool = False) -> bool:
         """
         Generate a new name for the file based on the text content.
 
         This method uses the preset instruct model to process the text content
         and generate a new name for the file. The new filename is stored in the
-        `new_name` attribute of the object. Assumes the `text_content` attribute
-        contains the full text content of the file.
-        """
-        prompt = """Instruction: Generate a short descriptive filename for this text file.
-        Content:\n 
-        """
+        `new_name` attribute of the object. Assumes the `input_ids` attribute
+        was filled during extraction (see `tokenize_files`), or at least that
+        the `text_content` attribute contains the full text content of the file.
 
+        Args:
+            max_time (float): seconds after which the generation is cut short
+            fast (bool): use cheaper decoding settings
+
+        Returns:
+            bool: False if the generation was cut short by `max_time`
+        """
         print(f"Text content length: {len(self.text_content)}")
-        input_text = prompt + self.text_content
 
-        print("Processing text...")
-        inputs = flan_tokenizer([input_text], return_tensors='pt', truncation=True)
+        # Normally tokenized during extraction, this is only a fallback
+        if self.input_ids is None:
+            print("Processing text...")
+            self.tokenize_text_content()
 
         ## Uncomment to see the tokens of the input
-        # print("Input tokens:", inputs.tokens())
+        # print("Input tokens:", models.get_flan_tokenizer().convert_ids_to_tokens(self.input_ids[0]))
 
-        # Move inputs to the same device as flan_model
-        inputs = inputs.to(flan_model.device)
-        
         print("Generating output...")
-        output_ids = flan_model.generate(
-            inputs['input_ids'],
-            min_length=10,
-            max_length=25,
-            do_sample=False,  # Deterministic output for reliability
-            repetition_penalty=1.5,  # Penalize repetitive tokens
-            no_repeat_ngram_size=3  # Avoid repeated phrases
-        )
-
-        # Decode the output
-        decoded_output = flan_tokenizer.decode(output_ids[0], skip_special_tokens=True)
+        generation = run_on_backend(
+            "generate_text_names", [self.input_ids], max_time=max_time, fast=fast
+        )[0]
+        self.embedding = generation.embedding
+        self.decode_steps = generation.decode_steps
+        print(f"Decoded {self.decode_steps} tokens")
 
         # Set the generated filename
-        self.new_name = f"{decoded_output}.{self.file_type}"
+        self.new_name = f"{generation.text}.{self.file_type}"
+        return not generation.timed_out
 
-    def generate_image_name(self) -> None:
+    def generate_image_name(self, max_time: float = None, fast: bool = False) -> bool:
         """
         Generate a new name for the file based on the image content.
 
@@ -225,75 +496,159 @@ class File:
         The new filename is stored in the `new_name` attribute of the object.
         This method assumes that the `original_path` attribute points to an
         image file.
-        """
-        inputs = blip_processor(self.image_content, return_tensors="pt")
 
-        # Move inputs to the same device as blip_model
-        inputs = inputs.to(blip_model.device)
+        Args:
+            max_time (float): seconds after which the generation is cut short
+            fast (bool): use greedy decoding instead of beam search
 
+        Returns:
+            bool: False if the generation was cut short by `max_time`
+        """
         print("Generating output...")
-        hyper_params = {
-            "do_sample": False,          # No sampling for deterministic results
-            "num_beams": 8,              # Beam search to improve reliability
-            "repetition_penalty": 1.3,   # Higher repetition penalty
-            "no_repeat_ngram_size": 3,   # Avoid repeating the 3 same words
-            "min_length": 10,
-            "max_length": 25
-            }
-        out = blip_model.generate(**inputs, **hyper_params)
-        name: str = clean_caption(blip_processor.decode(out[0], skip_special_tokens=True))
+        generation = run_on_backend(
+            "generate_image_captions", [self.image_content], max_time=max_time, fast=fast
+        )[0]
+        self.embedding = generation.embedding
+        name: str = clean_caption(generation.text)
         self.new_name = f"{name.replace(' ', '_')}.{self.file_type}"
+        return not generation.timed_out
 
 
     def build_new_path(self) -> None:
         """
         From the new filename and the original path, build the new path and
-        store it in the `new_path` attribute.
+        store it in the `new_path` attribute. If a target subfolder was
+        proposed (see the sorting module), the file is moved into it.
         """
         # Extract directory from the original path
         directory = dirname(self.original_path)
+        if self.folder != "":
+            directory = join(directory, self.folder)
 
         # Join directory and new filename to create the new path, and normalize it
         self.new_path = normpath(join(directory, self.new_name))
 
-    def process_file(self, file_number: int) -> None:
+    def name_from_metadata(self, candidate: tuple = None) -> bool:
+        """
+        Metadata-first fast path: names the file directly from its metadata
+        (PDF title or outline, EXIF data) if they are good enough, without
+        running any model.
+
+        Args:
+            candidate (tuple): the metadata candidate of the file if already
+                known (see `metadata.best_candidate`), looked up otherwise
+
+        Returns:
+            bool: True if the file was named, False if it needs the models
+        """
+        name = metadata.metadata_name(self, metadata.GOOD_ENOUGH_SCORE, candidate)
+        if name == "":
+            return False
+        self.new_name = f"{name}.{self.file_type}"
+        self.fallback_reason = ""
+        self.build_new_path()
+        return True
+
+    def fall_back(self, reason: str, candidate: tuple = None) -> bool:
+        """
+        Names the file from its metadata when the model can't be used, and
+        records the reason in the `fallback_reason` attribute.
+
+        Args:
+            reason (str): why the model couldn't be used
+            candidate (tuple): the metadata candidate of the file if already
+                known, looked up otherwise
+
+        Returns:
+            bool: True if a name was found, False if the file is skipped
+        """
+        name = metadata.metadata_name(self, candidate=candidate)
+        if name != "":
+            self.new_name = f"{name}.{self.file_type}"
+            self.fallback_reason = f"{reason}, named from metadata"
+        else:
+            self.fallback_reason = f"{reason}, skipped"
+        print(f"Fallback: {self.fallback_reason}")
+        return name != ""
+
+    def process_file(self, file_number: int, budget: deadline.Budget = None,
+                     metadata_candidate: tuple = None) -> None:
         """
         Processes a file using its corresponding File object.
         If an error occurs during the process, the file is skipped.
 
+        The generation is bounded by the given time budget: with little time
+        left, cheaper decoding is used, and once the budget is exhausted the
+        file is named from its metadata (or skipped). The reason is recorded
+        in the `fallback_reason` attribute.
+
         Args:
             file_number (int): the number of the file in the list of files to process
                 (purely for display and logging purposes)
+            budget (deadline.Budget): the time budget for this file, a new
+                budget of deadline.FILE_TIME_BUDGET seconds by default
+            metadata_candidate (tuple): the metadata candidate of the file to
+                fall back to, if already known (it's looked up otherwise,
+                which opens the file with fitz or PIL)
         """
         print(f"\nWorking on file n°{file_number}")
         print(f"File path : {self.original_path}")
 
+        if budget is None:
+            budget = deadline.Budget(deadline.FILE_TIME_BUDGET)
+        self.fallback_reason = ""
+
         # Check if the file type is supported (case-insensitive)
         if self.file_type.lower() in file_formats["text_formats"]:
-            if self.text_content == "":
+            generate_name = self.generate_text_name
+
+            # Checking the flag, not loading the content from the spill store
+            if not self._has_text:
                 # No content was extracted, either met an issue or the file
                 # may be empty
                 # NOTE could extend this to handling files too short to have
                 # any value for name generation, e.g. len(content) < 100 or so
-                return
-
-            if self.generate_text_name() == "":
-                # No name was generated, skipping this file
-                return
+                if self.error == "" or not self.fall_back(f"extraction failed ({self.error})", metadata_candidate):
+                    return
+                generate_name = None
 
         elif self.file_type.lower() in file_formats["image_formats"]:
-            if self.image_content is None:
+            generate_name = self.generate_image_name
+
+            if not self._has_image:
                 # No content was extracted, met an issue when opening the image
-                return
-            
-            if self.generate_image_name() == "":
-                # No name was generated, skipping this file
-                return
+                if self.error == "" or not self.fall_back(f"extraction failed ({self.error})", metadata_candidate):
+                    return
+                generate_name = None
 
         else:
             # File format not in file_formats, skipping it.
             return
 
+        if generate_name is not None:
+            if budget.expired():
+                if not self.fall_back("time budget exhausted", metadata_candidate):
+                    return
+            else:
+                fast = budget.remaining() < deadline.FAST_GENERATION_BELOW
+                if fast:
+                    self.fallback_reason = "low time budget, cheaper decoding"
+                try:
+                    complete = generate_name(max_time=deadline.max_time(budget), fast=fast)
+                except Exception as e:
+                    print(f"Error: {e} when generating a name")
+                    if not self.fall_back(f"generation failed ({e})", metadata_candidate):
+                        return
+                else:
+                    if not complete:
+                        # The name may be truncated mid-way, the metadata
+                        # name is preferred when there is one
+                        reason = "generation cut short by the time budget"
+                        truncated_name = self.new_name
+                        if not self.fall_back(reason, metadata_candidate):
+                            self.new_name = truncated_name
+                            self.fallback_reason = f"{reason}, name may be truncated"
+
         print(f"Generated new name: [{self.new_name}]")
         self.build_new_path()
         print(f"Built new path: {self.new_path}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+This is the headless module, running TrueName from the command line without
+the GUI, on top of the service module:
+
+    python headless.py [--rename] [--recursive] PATH [PATH ...]
+
+Paths can be files or directories. The new path of each file is printed as
+soon as it's ready. Without --rename, nothing is renamed on disk.
+"""
+import argparse
+import asyncio
+import sys
+from multiprocessing import freeze_support
+from os import walk
+from os.path import isdir, join, normpath
+
+import session
+import service
+
+
+def iter_paths(paths: list, recursive: bool = False):
+    """
+    Yields the files among the given paths, and the files in the given
+    directories (and their subdirectories if recursive).
+    """
+    for path in paths:
+        if not isdir(path):
+            yield normpath(path)
+            continue
+        for directory, subdirectories, filenames in walk(path):
+            for filename in sorted(filenames):
+                yield normpath(join(directory, filename))
+            if not recursive:
+                break
+
+
+async def submit_paths(truename, paths) -> None:
+    """
+    Submits the files to the service, then closes it, even if listing or
+    submitting them fails, so the results iterator always ends.
+    """
+    try:
+        await truename.submit(paths)
+    finally:
+        await truename.close()
+
+
+async def run(args) -> int:
+    """
+    Submits the files to the service while printing the results.
+
+    Returns:
+        int: the exit code, 1 if any file failed, or the files couldn't
+            all be submitted
+    """
+    session_state = None if args.no_session else session.SessionState()
+    counts = {}
+    async with service.TrueNameService(
+        max_in_flight=args.max_in_flight, rename=args.rename, session_state=session_state
+    ) as truename:
+        # The paths are only listed as the service takes them
+        submitter = asyncio.create_task(submit_paths(truename, iter_paths(args.paths, args.recursive)))
+        async for result in truename:
+            counts[result.status] = counts.get(result.status, 0) + 1
+            if result.status == service.FAILED:
+                print(f"{result.file.original_path} -> error: {result.error}")
+            elif result.status != service.SKIPPED:
+                print(f"{result.file.original_path} -> {result.file.new_path}")
+        try:
+            await submitter
+            submitted = True
+        except Exception as e:
+            print(f"Error: {e} when submitting files")
+            submitted = False
+
+    print(", ".join(f"{count} {status}" for status, count in counts.items()) or "No files")
+    return 1 if counts.get(service.FAILED) or not submitted else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Renames files based on their content, without the GUI")
+    parser.add_argument("paths", nargs="+", help="files or directories to process")
+    parser.add_argument("--rename", action="store_true", help="rename the files on disk")
+    parser.add_argument("--recursive", action="store_true", help="process the subdirectories too")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="files processed at once")
+    parser.add_argument("--no-session", action="store_true",
+                        help="don't reuse or record the names of previous sessions")
+    args = parser.parse_args()
+
+    try:
+        return asyncio.run(run(args))
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
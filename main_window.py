@@ -17,19 +17,28 @@ from PyQt6.QtWidgets import (
     QStyledItemDelegate,
     QMessageBox
 )
-from PyQt6.QtCore import pyqtSlot, Qt
+from PyQt6.QtCore import pyqtSlot, Qt, QObject, QTimer, pyqtSignal
 from PyQt6.QtGui import QColor, QIcon
 import sys
 # from namegen import generate_new_file_paths
 from progressbar import ProgressBarWindow
 from time import time
 import file
-from os.path import normpath, exists, basename, split, abspath, join
-from os import getcwd
+import deadline
+import extraction
+import sorting
+import session
+import models
+import model_server
+import qt_bridge
+import service
+from os.path import normpath, exists, basename, split, dirname
+from os import getcwd, rmdir
+from multiprocessing import freeze_support
+from threading import Thread
 from typing import List
 from clean_filename import secure_filename, dynamic_rename
-from ctypes import windll
-from os import startfile
+from resources import get_resource_path
 
 
 PATH_TO_ICON = 'truename_icon.ico'
@@ -37,7 +46,10 @@ PATH_TO_ICON = 'truename_icon.ico'
 # Differentiate the app from other Python apps
 # to ensure that the correct icon is used in the taskbar :
 APP_ID = 'Portfolio.TrueName.GUI.1'
-windll.shell32.SetCurrentProcessExplicitAppUserModelID(APP_ID)
+if sys.platform == 'win32':
+    from ctypes import windll
+    from os import startfile
+    windll.shell32.SetCurrentProcessExplicitAppUserModelID(APP_ID)
 
 # TODO update variables and docs, clean up inconsistencies, rename "namegen"
 
@@ -47,7 +59,12 @@ class TrueNameMainWindow(QMainWindow):
 
     Inherits from QMainWindow and provides functionality for opening a file dialog, generating new names,
     and displaying original paths and filenames as well as new filenames.
+
+    Signals:
+        run_finished: a run of the core service (generation or renaming) ended
     """
+    run_finished = pyqtSignal()
+
     # TODO rewrite docs
     def __init__(self):
         """
@@ -114,6 +131,12 @@ class TrueNameMainWindow(QMainWindow):
 
         right_buttons_layout.addStretch(1)
 
+        # Button to propose subfolders for the files with a new name
+        sort_button = QPushButton(self)
+        sort_button.setText("Sort into folders")
+        sort_button.clicked.connect(self.sort_files)
+        right_buttons_layout.addWidget(sort_button)
+
         # Button to rename the files with the selected filenames
         rename_button = QPushButton(self)
         rename_button.setObjectName("rename_button")
@@ -196,6 +219,41 @@ class TrueNameMainWindow(QMainWindow):
         # File list
         self.files_instance_list: List[file.File] = []
 
+        # Work done on the files in previous sessions
+        self.session = session.SessionState()
+
+        # The current run of the core service, and the files submitted to it
+        self.bridge = None
+        self.run_files = []
+        self.run_rows = {}
+        self.run_done = 0
+        self.run_start = 0.0
+
+        # Loading the models in the background once the window is shown (see
+        # showEvent), the window is usable meanwhile
+        self.statusBar().showMessage("Loading models...")
+        self.warm_up_thread = ModelWarmUpThread()
+        self.warm_up_thread.finished_loading.connect(self.statusBar().showMessage)
+
+
+    def showEvent(self, event):
+        """
+        Starts loading the models once the window is shown, after its first
+        paint, so the imports don't compete with it.
+        """
+        super().showEvent(event)
+        QTimer.singleShot(0, self.warm_up_thread.start)
+
+
+    def closeEvent(self, event):
+        """
+        Cancels the current run of the core service, if any, so the files
+        queued in it are dropped.
+        """
+        if self.bridge is not None and self.bridge.is_running():
+            self.bridge.cancel()
+        super().closeEvent(event)
+
 
     @pyqtSlot()
     def open_dialog(self):
@@ -203,6 +261,8 @@ class TrueNameMainWindow(QMainWindow):
         Opens the file dialog and adds selected files (file paths) to the
         source_files_list widget.
         """
+        if self.is_busy():
+            return
         added_file_paths, _ = QFileDialog.getOpenFileNames(
             self,
             "Add File",
@@ -211,93 +271,221 @@ class TrueNameMainWindow(QMainWindow):
         )
         # TODO only allow file extensions supported by the app
 
-        # List of file paths listed in the widget before adding more
-        present_file_paths = []
+        # File paths listed in the widget before adding more
+        present_file_paths = set()
         for i in range(self.source_files_list.count()):
             item = self.source_files_list.item(i)
-            present_file_paths.append(item.text())
+            present_file_paths.add(item.text())
+
+        # Files changed or never seen in a previous session, to extract
+        files_to_extract = []
+        restored_count = 0
 
         # Adding file paths to the list widget
         for added_file_path in added_file_paths:
             # Only if they're not already in the list (no doubles)
             if normpath(added_file_path) not in present_file_paths:
+                present_file_paths.add(normpath(added_file_path))
                 item = QListWidgetItem(self.source_files_list)
                 item.setText(normpath(added_file_path))
                 self.source_files_list.addItem(item)
                 current_file = file.File(added_file_path)
                 self.files_instance_list.append(current_file)
-                
-                # Extracting text or image content for the file depending on its type
-                if current_file.file_type.lower() in file.file_formats["text_formats"]:
-                    current_file.extract_text_content()
-                elif current_file.file_type.lower() in file.file_formats["image_formats"]:
-                    current_file.extract_image_content()
+
+                # Unchanged files get their previous name back, without extraction
+                if self.session.restore(current_file):
+                    restored_count += 1
                 else:
-                    pass
+                    files_to_extract.append(current_file)
+
+        self.extract_contents(files_to_extract)
+        for current_file in files_to_extract:
+            # Unsupported files were not extracted, no need to hash them.
+            # Files whose text didn't change keep their previous name.
+            if current_file.extracted and self.session.record(current_file):
+                restored_count += 1
+        self.session.save()
+
+        if restored_count > 0:
+            self.display_new_file_paths()
+
+    def extract_contents(self, files: list):
+        """
+        Extracts text or image content for the given File objects depending
+        on their type: text files in parallel across worker processes, then
+        tokenized in one batch.
+        """
+        text_files = []
+        for current_file in files:
+            if current_file.file_type.lower() in file.file_formats["text_formats"]:
+                text_files.append(current_file)
+            elif current_file.file_type.lower() in file.file_formats["image_formats"]:
+                current_file.extract_image_content()
+            else:
+                pass
+
+        # Extracting the text files across worker processes
+        text_paths = [text_file.original_path for text_file in text_files]
+        # With a timeout, even a single PDF is extracted in a worker process:
+        # a process start, but a pathological file can't stall the window
+        results = extraction.extract_texts(text_paths, timeout=deadline.EXTRACTION_TIME_BUDGET)
+        for text_file, result in zip(text_files, results):
+            text_file.set_extraction_result(result)
+
+        # Prefetching the model inputs, in one batch for all the text files
+        file.tokenize_files(text_files)
 
 
     @pyqtSlot()
     def generate_filenames(self):
         """
-        Generates new names for the selected files and displays them in the new_file_paths_list.
+        Generates new names for the selected files through the core service
+        (see the service module), in the background. Each name is displayed
+        in the new_file_paths_list as soon as it's ready. Files that already
+        have a name (e.g. restored from a previous session) keep it.
         """
-        # TODO extended for bugfixing and security, might be better as a loop
-        # I'd like to rework/refactor this method anyway
-        file_paths = [item.text() for item in self.source_files_list.selectedItems() if exists(item.text())]
-        file_count = len(file_paths)
+        if self.is_busy():
+            return
+        files = [
+            self.files_instance_list[row] for row in selected_rows(self.source_files_list)
+            if exists(self.files_instance_list[row].original_path)
+        ]
 
         # If no file path was added, don't do anything
-        if file_count == 0:
+        if len(files) == 0:
             return
 
-        start_time = time()
-        print(file_paths)
-        file_number = 0
-        progress = 0
-        self.progress_window.show()
-        print(f"Working on {file_count} files...")
+        # All the rows, for the names to be displayed as they come
+        self.display_new_file_paths()
+        self.progress_window.set_progress(0)
+        print(f"Working on {len(files)} files...")
+        self.run_service(files, rename=False)
+
 
-        # NOTE Could trade worse memory usage for better performance here ?
+    @pyqtSlot()
+    def sort_files(self):
+        """
+        Proposes a target subfolder for every file with a generated name, by
+        clustering similar files together, and displays the resulting paths.
+        Files are only moved when renamed.
+        """
+        if self.is_busy():
+            return
+        sorting.propose_folders(self.files_instance_list)
         for current_file in self.files_instance_list:
-            if current_file.original_path in file_paths:
-                # Update progress bar before process a File
-                self.progress_window.set_progress(int(progress))
-                QApplication.processEvents()
-                file_number += 1
-                progress = file_number / file_count * 100
-                current_file.process_file(file_number)
-
-        # Updating after the loop in any case (esp. for file_count = 0)
-        self.progress_window.set_progress(int(progress))
-        QApplication.processEvents()
-
-        end_time = time()
-        print(f"Elapsed time : {end_time - start_time:.03f} seconds.")
+            self.session.record_name(current_file)
+        self.session.save()
         self.display_new_file_paths()
 
 
     @pyqtSlot()
     def rename_files(self):
         """
-        Renames the files whose (new) names are selected in the right-side widget
+        Renames the files whose (new) names are selected in the right-side
+        widget through the core service, in the background. Each renamed
+        file is colored as soon as it's done.
         """
-        # TODO rework into one loop using item, not item.text() ?
-        file_paths = [normpath(item.text()) for item in self.new_file_paths_list.selectedItems()]
+        if self.is_busy():
+            return
+        files = [
+            self.files_instance_list[row] for row in selected_rows(self.new_file_paths_list)
+            if self.files_instance_list[row].new_path != ""
+            and exists(self.files_instance_list[row].original_path)
+        ]
+        if len(files) == 0:
+            return
+        self.run_service(files, rename=True)
 
-        # NOTE need to be careful the slash/antislash Windows quirks
-        for current_file in self.files_instance_list:
-            if current_file.new_path in file_paths:
-                old_path = normpath(current_file.original_path)
-                new_path = normpath(current_file.new_path)
-                if exists(old_path):
-                    dynamic_rename(old_path, new_path)
 
-        # Color all the renamed items (for UX reasons)
-        for item in self.new_file_paths_list.selectedItems():
-            if item.text() != "":
-                self.new_file_paths_list.blockSignals(True)
-                item.setBackground(QColor("lightgreen"))
-                self.new_file_paths_list.blockSignals(False)
+    def run_service(self, files: list, rename: bool):
+        """
+        Submits the given File objects to a new run of the core service,
+        through a ServiceBridge: the results are delivered to `on_result`,
+        then `on_run_finished` is called. File objects already named keep
+        their name, and are renamed on disk if `rename` is set.
+        """
+        # The rows of the files in both list widgets, stable during the run:
+        # the slots changing the file list are disabled meanwhile
+        rows = {id(current_file): row for row, current_file in enumerate(self.files_instance_list)}
+        self.run_rows = {id(current_file): rows[id(current_file)] for current_file in files}
+        self.run_files = files
+        self.run_done = 0
+        self.run_start = time()
+        # The session state is only used from the GUI thread, not the service
+        self.bridge = qt_bridge.ServiceBridge(self, rename=rename)
+        self.bridge.result_ready.connect(self.on_result)
+        self.bridge.finished.connect(self.on_run_finished)
+        self.bridge.start()
+        self.bridge.submit(files, close=True)
+
+
+    def is_busy(self) -> bool:
+        """
+        Returns True if a run of the core service is in progress, telling the
+        user to wait in the status bar.
+        """
+        if self.bridge is None:
+            return False
+        self.statusBar().showMessage("Please wait for the current files to be processed", 3000)
+        return True
+
+
+    @pyqtSlot(object)
+    def on_result(self, result):
+        """
+        Displays the new path of a file processed by the core service, green
+        if it was renamed.
+        """
+        current_file = result.file
+        row = self.run_rows[id(current_file)]
+        self.run_done += 1
+        if result.status == service.NAMED:
+            self.session.record_name(current_file)
+
+        item = self.new_file_paths_list.item(row)
+        self.new_file_paths_list.blockSignals(True)
+        item.setText(current_file.new_path)
+        if current_file.fallback_reason != "":
+            item.setToolTip(current_file.fallback_reason)
+        if current_file.new_path != "":
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsEditable)
+        # Color the renamed items (for UX reasons)
+        if result.status == service.RENAMED:
+            item.setBackground(QColor("lightgreen"))
+        self.new_file_paths_list.blockSignals(False)
+
+        if not self.bridge.service.rename:
+            self.progress_window.set_progress(int(self.run_done / len(self.run_rows) * 100))
+
+
+    @pyqtSlot()
+    def on_run_finished(self):
+        """
+        Ends the current run of the core service, and reports the statistics
+        of the generation.
+        """
+        truename = self.bridge.service
+        self.bridge.deleteLater()
+        self.bridge = None
+
+        if not truename.rename:
+            self.progress_window.set_progress(100)
+            print(f"Elapsed time : {time() - self.run_start:.03f} seconds.")
+            report_metadata_hits(
+                truename.metadata_hits, truename.metadata_hits + truename.generated_count,
+                truename.metadata_time, truename.models_time
+            )
+            fallback_count = sum(current_file.fallback_reason != "" for current_file in self.run_files)
+            if fallback_count > 0:
+                print(f"{fallback_count} files were not named by the full generation (see their tooltip)")
+            decoded_files = [current_file for current_file in self.run_files if current_file.decode_steps > 0]
+            if len(decoded_files) > 0:
+                decode_steps = sum(current_file.decode_steps for current_file in decoded_files)
+                print(f"Average decode steps per text file: {decode_steps / len(decoded_files):.1f}")
+            self.session.save()
+        self.run_files = []
+        self.run_rows = {}
+        self.run_finished.emit()
 
 
     def display_new_file_paths(self):
@@ -308,10 +496,13 @@ class TrueNameMainWindow(QMainWindow):
         """
         self.new_file_paths_list.clear()
         # All the new file paths, including for files not selected by the user
-        file_paths = [file_item.new_path for file_item in self.files_instance_list]
-        for path in file_paths:
+        for file_item in self.files_instance_list:
+            path = file_item.new_path
             # The displayed path will be an empty string if the source path was not selected
             item = QListWidgetItem(path)
+            # Explaining why a file was named in a degraded way, if it was
+            if file_item.fallback_reason != "":
+                item.setToolTip(file_item.fallback_reason)
             # NOTE This condition makes it so empty paths (unselected) are not editable
             if path != "":
                 item.setFlags(item.flags() | Qt.ItemFlag.ItemIsEditable)
@@ -356,7 +547,8 @@ class TrueNameMainWindow(QMainWindow):
                 dir_path, filename = split(normpath(path))
                 # NOTE could also do filename = secure_filename() instead
                 # but I prefer leaving it to the user in this case.
-                if exists(dir_path) and filename == secure_filename(filename):
+                # The directory may be a proposed subfolder, not created yet
+                if (exists(dir_path) or exists(dirname(dir_path))) and filename == secure_filename(filename):
                     f_obj.new_path = path
                     self.new_file_paths_list.item(i_new_paths).setBackground(QColor("white"))
                 else:
@@ -374,15 +566,23 @@ class TrueNameMainWindow(QMainWindow):
         using the corresponding original_path value.
         Similar to rename_files but in reverse, using a different color code.
         """
-        file_paths = [normpath(item.text()) for item in self.new_file_paths_list.selectedItems()]
+        if self.is_busy():
+            return
 
-        for current_file in self.files_instance_list:
-            if current_file.new_path in file_paths:
+        for row in selected_rows(self.new_file_paths_list):
+            current_file = self.files_instance_list[row]
+            if current_file.new_path != "":
                 old_path = normpath(current_file.original_path)
                 new_path = normpath(current_file.new_path)
                 if exists(new_path):
                     # Inverse rename using old path value for this file
                     dynamic_rename(new_path, old_path)
+                    if current_file.folder != "":
+                        try:
+                            # Removing the proposed subfolder once empty
+                            rmdir(dirname(new_path))
+                        except OSError:
+                            pass
 
         # Color all the reverted filenames (orange this time, again for UX reasons)
         for item in self.new_file_paths_list.selectedItems():
@@ -409,6 +609,8 @@ class TrueNameMainWindow(QMainWindow):
         Removes all selected files from the list widget and files_instance_list.
         The current selection is cleared.
         """
+        if self.is_busy():
+            return
 
         items_to_remove = []
 
@@ -444,6 +646,58 @@ class TrueNameMainWindow(QMainWindow):
             QMessageBox.critical(self, "Error", f"Failed to open file: {file_path}\n\n{str(e)}")
 
 
+class ModelWarmUpThread(QObject):
+    """
+    Loads the models in a background thread, then emits a status message.
+    Only the preprocessors are loaded if a model server already holds the
+    models.
+
+    The thread is a daemon Python thread rather than a QThread: loading can
+    take minutes on a first launch, and closing the window meanwhile must
+    neither wait for it nor destroy a running QThread. The signal is emitted
+    from the thread, so the connected slots run in the GUI thread.
+    """
+    finished_loading = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Starts loading, does nothing if already started.
+        """
+        if self._thread.ident is None:
+            self._thread.start()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits for the loading to end, if started.
+
+        Returns:
+            bool: True if the thread isn't running anymore
+        """
+        if self._thread.ident is not None:
+            self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def run(self):
+        try:
+            if model_server.get_client() is not None:
+                models.warm_up(include_models=False)
+                message = "Models ready (model server)"
+            else:
+                models.warm_up()
+                message = "Models ready"
+        except Exception as e:
+            message = f"Error when loading models: {e}"
+        try:
+            self.finished_loading.emit(message)
+        except RuntimeError:
+            # The window was closed and deleted meanwhile
+            pass
+
+
 class FileNameDelegate(QStyledItemDelegate):
     """
     Proxy class to customize the styling of an element.
@@ -459,19 +713,28 @@ class FileNameDelegate(QStyledItemDelegate):
         return f"{filename}"
 
 
-def get_resource_path(relative_path):
+def selected_rows(list_widget: QListWidget) -> list:
     """
-    Get correct absolute path to resource, works for dev version (script) and
-    for distribution version with PyInstaller.
+    Returns the rows of the selected items of the given list widget, in
+    order. The rows of both list widgets are the indexes of the files in
+    files_instance_list.
     """
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = sys._MEIPASS
-    except Exception:
-        # No _MEIPASS, assuming dev version & using the basic absolute path
-        base_path = abspath(".")
+    return sorted(list_widget.row(item) for item in list_widget.selectedItems())
+
 
-    return join(base_path, relative_path)
+def report_metadata_hits(hit_count: int, file_count: int, metadata_time: float, models_time: float):
+    """
+    Prints the hit rate of the metadata-first fast path, and an estimate of
+    the time it saved: the average model time per file, for each hit, minus
+    the time spent reading metadata.
+    """
+    if file_count == 0:
+        return
+    print(f"Named from metadata: {hit_count}/{file_count} files ({hit_count / file_count:.0%})")
+    model_count = file_count - hit_count
+    if hit_count > 0 and model_count > 0:
+        saved = hit_count * models_time / model_count - metadata_time
+        print(f"Estimated time saved by metadata naming: {saved:.03f} seconds.")
 
 
 def fit_to_screen(widget: QWidget, ratio: float):
@@ -495,6 +758,8 @@ def fit_to_screen(widget: QWidget, ratio: float):
     widget.setGeometry(margin_left, margin_top, desired_width, desired_height)
 
 if __name__ == "__main__":
+    # Needed by the extraction worker processes in the PyInstaller build
+    freeze_support()
     app = QApplication(sys.argv)
     main_gui = TrueNameMainWindow()
     main_gui.show()
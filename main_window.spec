@@ -1,4 +1,8 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
+
+# Ship the local model bundle when it was exported (python models.py export)
+bundle_datas = [('model_bundle', 'model_bundle')] if os.path.isdir('model_bundle') else []
 
 
 a = Analysis(
@@ -8,12 +12,13 @@ a = Analysis(
     datas=[
         ('styles.qss', '.'),
         ('truename_icon.ico', '.')
-    ],
+    ] + bundle_datas,
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Not used by the app, transformers only imports them when available
+    excludes=['tkinter', 'torchaudio'],
     noarchive=False,
 )
 pyz = PYZ(a.pure)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+This is the metadata module, used to name files from their metadata (PDF
+title and outline, photo EXIF data) without running any model. It's much
+cheaper than generation: no page is rendered and no pixel is decoded.
+
+Each candidate name gets a score between 0 and 1 telling how usable it is.
+Files whose best candidate reaches GOOD_ENOUGH_SCORE are named directly,
+before the models run. Any candidate is still better than nothing as a
+fallback when the models can't be used.
+"""
+# Whether files with good enough metadata skip the models
+METADATA_FIRST = True
+GOOD_ENOUGH_SCORE = 0.7
+
+# Titles that tell nothing about the content (compared lowercase)
+JUNK_TITLES = {
+    "untitled", "document", "title", "print", "scan", "scanned document",
+    "pdf", "presentation", "powerpoint presentation", "slide 1", "cover",
+    "contents", "table of contents", "introduction", "abstract", "preface",
+    "chapter 1", "page 1", "untitled document", "new document", "draft"
+}
+JUNK_PREFIXES = ("microsoft word - ", "microsoft powerpoint - ", "untitled")
+FILE_EXTENSIONS = (".doc", ".docx", ".odt", ".pdf", ".ppt", ".pptx", ".rtf", ".tex", ".txt", ".tmp", ".indd")
+MAX_TITLE_LENGTH = 120
+
+# Outline entries are often generic headings, trusted a bit less than titles
+OUTLINE_WEIGHT = 0.8
+
+# EXIF tags (from the base IFD and its Exif and GPS sub-IFDs)
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATETIME_ORIGINAL = 0x9003
+DATETIME = 0x0132
+MAKE = 0x010F
+MODEL = 0x0110
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+
+def score_title(title: str, original_name: str) -> float:
+    """
+    Scores how usable the given PDF title (or outline entry) is as a
+    filename, between 0 (useless) and 1.
+
+    Args:
+        title (str): the title to score
+        original_name (str): the current filename, without extension
+    """
+    title = " ".join(title.split())
+    lowered = title.lower()
+    if (
+        title == ""
+        or lowered in JUNK_TITLES
+        or lowered.startswith(JUNK_PREFIXES)
+        or lowered.endswith(FILE_EXTENSIONS)
+        or lowered == original_name.lower()
+    ):
+        return 0.0
+
+    # Mostly digits or symbols, e.g. "0012345-A" or "___"
+    letters = sum(c.isalpha() for c in title)
+    if letters < 0.5 * len(title.replace(" ", "")):
+        return 0.0
+
+    word_count = len(title.split())
+    if len(title) > MAX_TITLE_LENGTH:
+        return 0.3
+    if word_count == 1:
+        return 0.4
+    if word_count > 12:
+        return 0.6
+    return 1.0
+
+
+def pdf_candidates(path: str, original_name: str) -> list:
+    """
+    Returns the (name, score) candidates found in the metadata title and
+    first outline entry of the given PDF file.
+    """
+    import fitz
+
+    candidates = []
+    try:
+        with fitz.open(path) as doc:
+            title = ((doc.metadata or {}).get("title") or "").strip()
+            candidates.append((title, score_title(title, original_name)))
+
+            toc = doc.get_toc(simple=True)
+            if toc:
+                heading = toc[0][1].strip()
+                candidates.append((heading, OUTLINE_WEIGHT * score_title(heading, original_name)))
+    except Exception:
+        pass
+    return candidates
+
+
+def _gps_coordinate(value, reference) -> str:
+    """
+    Formats an EXIF GPS coordinate (degrees, minutes, seconds) like "48.86N".
+    """
+    degrees, minutes, seconds = (float(part) for part in value)
+    return f"{degrees + minutes / 60 + seconds / 3600:.2f}{reference}"
+
+
+def exif_candidate(path: str) -> tuple:
+    """
+    Returns the (name, score) candidate made of the capture date, camera
+    model and GPS position found in the EXIF data of the given image.
+    Only the image header is read, the pixels are never decoded.
+    A date is needed for the name to be of any use.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            exif = image.getexif()
+            date = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME) or ""
+            camera = str(exif.get(MODEL) or exif.get(MAKE) or "").strip("\x00 ")
+            gps = exif.get_ifd(GPS_IFD)
+            position = ""
+            if GPS_LATITUDE in gps and GPS_LONGITUDE in gps:
+                position = "_".join((
+                    _gps_coordinate(gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF, "N")),
+                    _gps_coordinate(gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF, "E"))
+                ))
+    except Exception:
+        return ("", 0.0)
+
+    date = str(date).strip("\x00 ")
+    if date == "":
+        return ("", 0.0)
+
+    # EXIF dates look like "2021:06:12 14:03:55"
+    date = date.replace(":", "-", 2).replace(" ", "_").replace(":", "-")
+    score = 0.6 + 0.15 * (camera != "") + 0.15 * (position != "")
+    name = "_".join(part for part in ("photo", date, camera, position) if part)
+    return (name, score)
+
+
+def best_candidate(current_file) -> tuple:
+    """
+    Returns the best (name, score) candidate for the given File object from
+    its metadata, ("", 0.0) if there is none.
+    """
+    from file import file_formats
+
+    if current_file.file_type.lower() in file_formats["text_formats"]:
+        candidates = pdf_candidates(current_file.original_path, current_file.original_name)
+    elif current_file.file_type.lower() in file_formats["image_formats"]:
+        candidates = [exif_candidate(current_file.original_path)]
+    else:
+        candidates = []
+    return max(candidates, key=lambda candidate: candidate[1], default=("", 0.0))
+
+
+def metadata_name(current_file, min_score: float = 0.0, candidate: tuple = None) -> str:
+    """
+    Returns a name for the given File object from its metadata, without the
+    extension, or "" if its metadata are of no use.
+
+    Args:
+        current_file (file.File): the file to name
+        min_score (float): the minimum score of the name, e.g.
+            GOOD_ENOUGH_SCORE to skip the models
+        candidate (tuple): the best (name, score) candidate of the file if
+            already known, looked up otherwise
+    """
+    name, score = best_candidate(current_file) if candidate is None else candidate
+    if score <= 0 or score < min_score:
+        return ""
+    return name
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+This is the model_server module, an optional local daemon keeping the models
+loaded in memory between TrueName sessions.
+
+Run `python model_server.py` to start the daemon. While it's running, the GUI
+(and any other client) sends its generation requests to it instead of loading
+the models itself. Requests from all the clients are coalesced into batches.
+"""
+from multiprocessing.connection import Listener, Client
+from os import environ, makedirs, remove, fdopen, open as os_open, O_CREAT, O_EXCL, O_WRONLY
+from os.path import join, exists
+from queue import Queue, Empty
+from secrets import token_bytes
+from threading import Thread, Event, Lock
+from collections import deque
+from time import monotonic
+from resources import STATE_DIR
+
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = int(environ.get("TRUENAME_SERVER_PORT", 47315))
+
+# The daemon writes a random authentication key here, only readable by the
+# current user. Clients can't connect without it.
+AUTHKEY_PATH = join(STATE_DIR, "server.key")
+
+# A client that found no server tries to connect again after this many seconds
+CONNECT_RETRY_INTERVAL = 5.0
+
+# Request kinds, named after the models module functions they call
+TEXT_REQUEST = "generate_text_names"
+IMAGE_REQUEST = "generate_image_captions"
+
+_client = None
+_client_lock = Lock()
+# When the last connection attempt failed, to retry after a while
+_failed_at = None
+
+
+class _PendingRequest:
+    """
+    A client request waiting in the server queue for its batch to run.
+    """
+    def __init__(self, kind: str, items: list, options: dict) -> None:
+        self.kind = kind
+        self.items = items
+        self.options = options
+        # Only requests with the same key are batched together
+        self.batch_key = (kind, bool(options.get("fast")))
+        self.results = None
+        self.error = None
+        self.done = Event()
+
+
+class ModelServer:
+    """
+    Serves generation requests over a localhost connection, keeping the models
+    resident in memory.
+
+    Every client connection gets its own thread, which only queues requests.
+    A single batching thread runs the models: it waits up to `coalesce_window`
+    seconds for other requests of the same kind and runs them all in one
+    batch of at most `max_batch_size` items.
+    """
+    def __init__(self, max_batch_size: int = 8, coalesce_window: float = 0.05) -> None:
+        self.max_batch_size = max_batch_size
+        self.coalesce_window = coalesce_window
+        self._queue = Queue()
+        # Requests of another kind met while coalescing, served next
+        self._deferred = deque()
+
+    def serve_forever(self) -> None:
+        """
+        Loads the models, then accepts client connections until interrupted.
+        """
+        import models
+
+        print("Loading models...")
+        models.get_flan_tokenizer()
+        models.get_flan_model()
+        models.get_blip_processor()
+        models.get_blip_model()
+
+        authkey = token_bytes(32)
+        write_authkey(authkey)
+
+        Thread(target=self._run_batches, args=(models,), daemon=True).start()
+
+        try:
+            with Listener((SERVER_HOST, SERVER_PORT), authkey=authkey) as listener:
+                print(f"Model server listening on {SERVER_HOST}:{SERVER_PORT}")
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except Exception as e:
+                        # Failed authentication or aborted connection
+                        print(f"Error: {e} when accepting a connection")
+                        continue
+                    Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+        finally:
+            if exists(AUTHKEY_PATH):
+                remove(AUTHKEY_PATH)
+
+    def _serve_client(self, conn) -> None:
+        """
+        Queues the requests of a client and sends back the results, until
+        the client disconnects.
+        """
+        with conn:
+            while True:
+                try:
+                    kind, items, options = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                if kind not in (TEXT_REQUEST, IMAGE_REQUEST):
+                    conn.send(("error", f"Unknown request kind: {kind}"))
+                    continue
+
+                request = _PendingRequest(kind, items, options)
+                self._queue.put(request)
+                request.done.wait()
+
+                try:
+                    if request.error is not None:
+                        conn.send(("error", request.error))
+                    else:
+                        conn.send(("ok", request.results))
+                except (EOFError, OSError):
+                    return
+
+    def _next_request(self, timeout=None):
+        """
+        Returns the next request to serve, deferred ones first.
+        Raises queue.Empty if none arrives before the timeout.
+        """
+        if self._deferred:
+            return self._deferred.popleft()
+        return self._queue.get(timeout=timeout)
+
+    def _run_batches(self, models) -> None:
+        """
+        Batching loop: coalesces requests of the same kind and runs them
+        through the corresponding models function.
+        """
+        while True:
+            first = self._next_request()
+            batch = [first]
+            item_count = len(first.items)
+            deadline = monotonic() + self.coalesce_window
+
+            while item_count < self.max_batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if request.batch_key != first.batch_key:
+                    self._deferred.append(request)
+                    continue
+                batch.append(request)
+                item_count += len(request.items)
+
+            items = [item for request in batch for item in request.items]
+            # The batch has to fit in the tightest time budget
+            max_times = [request.options["max_time"] for request in batch
+                         if request.options.get("max_time") is not None]
+            try:
+                results = getattr(models, first.kind)(
+                    items,
+                    max_time=min(max_times) if max_times else None,
+                    fast=bool(first.options.get("fast"))
+                )
+            except Exception as e:
+                for request in batch:
+                    request.error = str(e)
+                    request.done.set()
+                continue
+
+            # Splitting the results back between the requests
+            start = 0
+            for request in batch:
+                request.results = results[start:start + len(request.items)]
+                start += len(request.items)
+                request.done.set()
+
+
+class ModelClient:
+    """
+    Thin client of the model server. Exposes the same generation functions
+    as the models module, so both can be used interchangeably.
+    """
+    def __init__(self, conn) -> None:
+        self._conn = conn
+        self._lock = Lock()
+
+    def _request(self, kind: str, items: list, options: dict) -> list:
+        with self._lock:
+            self._conn.send((kind, items, options))
+            status, payload = self._conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Model server error: {payload}")
+        return payload
+
+    def generate_text_names(self, input_ids_list: list, max_time: float = None, fast: bool = False) -> list:
+        return self._request(TEXT_REQUEST, input_ids_list, {"max_time": max_time, "fast": fast})
+
+    def generate_image_captions(self, images: list, max_time: float = None, fast: bool = False) -> list:
+        return self._request(IMAGE_REQUEST, images, {"max_time": max_time, "fast": fast})
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def get_client():
+    """
+    Returns a client connected to the running model server, or None if no
+    server is running. The connection is reused once established. After a
+    failed attempt, the connection is attempted again at most every
+    CONNECT_RETRY_INTERVAL seconds, so a server started later gets used.
+    """
+    global _client, _failed_at
+    with _client_lock:
+        if _client is None:
+            if _failed_at is not None and monotonic() - _failed_at < CONNECT_RETRY_INTERVAL:
+                return None
+            _client = _connect()
+            _failed_at = None if _client is not None else monotonic()
+        return _client
+
+
+def reset_client() -> None:
+    """
+    Drops the current client (e.g. after the server went away), so the next
+    call to get_client tries to connect again.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = None
+
+
+def _connect():
+    """
+    Tries to connect to the model server. Returns a ModelClient, or None
+    if no server is running.
+    """
+    try:
+        with open(AUTHKEY_PATH, "rb") as f:
+            authkey = f.read()
+        return ModelClient(Client((SERVER_HOST, SERVER_PORT), authkey=authkey))
+    except Exception:
+        # No key file (server not started), refused or failed connection
+        return None
+
+
+def write_authkey(authkey: bytes) -> None:
+    """
+    Writes the authentication key to AUTHKEY_PATH, in a file created only
+    readable by the current user: anyone holding the key can send pickled
+    requests to the server. A key file left by a crashed server is replaced.
+    """
+    makedirs(STATE_DIR, exist_ok=True)
+    if exists(AUTHKEY_PATH):
+        remove(AUTHKEY_PATH)
+    # Never readable by others, not even between creation and a chmod
+    with fdopen(os_open(AUTHKEY_PATH, O_CREAT | O_EXCL | O_WRONLY, 0o600), "wb") as f:
+        f.write(authkey)
+
+
+if __name__ == "__main__":
+    try:
+        ModelServer().serve_forever()
+    except KeyboardInterrupt:
+        print("Model server stopped")
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+This is the models module, loading the models used to generate filenames and
+running them on batches of inputs. Models are only loaded on first use, so
+that a process relying on the model server never loads them.
+
+When a local model bundle is present (see `export_bundle`), models are loaded
+from it without ever reaching the Hugging Face hub. The bundle stores the
+weights as safetensors, which are memory-mapped instead of unpickled into RAM:
+startup is bounded by disk speed and processes loading the same bundle share
+the file pages.
+
+torch and transformers are heavy to import, so they are only imported when
+a model is actually needed, keeping the application startup fast.
+"""
+import sys
+from os import environ
+from os.path import isdir
+from threading import Lock
+from time import monotonic
+from typing import Any, NamedTuple
+from resources import get_resource_path
+
+
+# The models can be swapped for smaller stand-ins, e.g. for load tests
+FLAN_MODEL_ID = environ.get("TRUENAME_FLAN_MODEL", "google/flan-t5-large")
+BLIP_MODEL_ID = environ.get("TRUENAME_BLIP_MODEL", "Salesforce/blip-image-captioning-large")
+
+# Directory of the local model bundle, next to the app (or inside the
+# PyInstaller distribution). Each model gets a subdirectory named after it.
+BUNDLE_DIR = "model_bundle"
+
+_flan_tokenizer = None
+_flan_model = None
+_blip_processor = None
+_blip_model = None
+
+# Size of the document embeddings, randomly projected down from the encoder
+# hidden size (distances are roughly preserved, storage is 4x smaller)
+EMBEDDING_DIM = 256
+EMBEDDING_SEED = 0
+
+_projections = {}
+
+# Dynamic-length decoding of the FLAN names: the generation stops as soon as
+# the name is complete (end of sentence, or MAX_NAME_WORDS words), instead of
+# always decoding at least 10 tokens. False for the original fixed bounds.
+DYNAMIC_DECODING = True
+MAX_NAME_WORDS = 8
+# Decoded tokens ending a filename, once stripped of the SentencePiece "▁"
+STOP_TOKENS = {".", "!", "?", ";", ":", "\n"}
+
+_filename_masks = None
+
+# Models may be warmed up in a background thread while the GUI uses them.
+# One lock each, so the tokenizer stays available while a model loads.
+_flan_tokenizer_lock = Lock()
+_flan_model_lock = Lock()
+_blip_processor_lock = Lock()
+_blip_model_lock = Lock()
+
+
+class Generation(NamedTuple):
+    """
+    The output of a model for one input.
+
+    Attributes:
+        text (str): the decoded output
+        embedding (numpy.ndarray): a compact, L2-normalized float16 embedding
+            of the input, taken from the encoder output computed during the
+            generation (FLAN encoder or BLIP vision model)
+        decode_steps (int): the number of tokens decoded for this input
+        timed_out (bool): whether the generation was cut short by `max_time`,
+            the text may then be truncated mid-way
+    """
+    text: str
+    embedding: Any
+    decode_steps: int = 0
+    timed_out: bool = False
+
+
+def bundle_path(model_id: str) -> str:
+    """
+    Returns the path of the given model in the local bundle.
+    """
+    return get_resource_path(f"{BUNDLE_DIR}/{model_id.split('/')[-1]}")
+
+
+def pretrained_kwargs(model_id: str, weights: bool = False) -> dict:
+    """
+    Returns the `from_pretrained` source and keyword arguments for the given
+    model: the local bundle if it exists (local files only, memory-mapped
+    safetensors weights), or the hub ID otherwise.
+
+    Args:
+        model_id (str): the hub ID of the model
+        weights (bool): whether model weights are loaded (not just a tokenizer)
+
+    Returns:
+        dict: the keyword arguments, including `pretrained_model_name_or_path`
+    """
+    local_path = bundle_path(model_id)
+    if not isdir(local_path):
+        return {"pretrained_model_name_or_path": model_id}
+
+    kwargs = {"pretrained_model_name_or_path": local_path, "local_files_only": True}
+    if weights:
+        kwargs["use_safetensors"] = True
+    return kwargs
+
+
+def get_flan_tokenizer():
+    """
+    Returns the FLAN tokenizer (the fast, Rust-backed one), loading it on the
+    first call.
+    """
+    global _flan_tokenizer
+    with _flan_tokenizer_lock:
+        if _flan_tokenizer is None:
+            from transformers import AutoTokenizer
+
+            _flan_tokenizer = AutoTokenizer.from_pretrained(**pretrained_kwargs(FLAN_MODEL_ID), use_fast=True)
+        return _flan_tokenizer
+
+
+def get_flan_model():
+    """
+    Returns the FLAN model, loading it on the first call.
+    """
+    global _flan_model
+    with _flan_model_lock:
+        if _flan_model is None:
+            from transformers import AutoModelForSeq2SeqLM
+
+            _flan_model = AutoModelForSeq2SeqLM.from_pretrained(
+                **pretrained_kwargs(FLAN_MODEL_ID, weights=True),
+                device_map="auto"
+            )
+        return _flan_model
+
+
+def get_blip_processor():
+    """
+    Returns the BLIP processor, loading it on the first call.
+    """
+    global _blip_processor
+    with _blip_processor_lock:
+        if _blip_processor is None:
+            from transformers import BlipProcessor
+
+            _blip_processor = BlipProcessor.from_pretrained(**pretrained_kwargs(BLIP_MODEL_ID))
+        return _blip_processor
+
+
+def get_blip_model():
+    """
+    Returns the BLIP model, loading it on the first call.
+    """
+    global _blip_model
+    with _blip_model_lock:
+        if _blip_model is None:
+            from transformers import BlipForConditionalGeneration
+
+            _blip_model = BlipForConditionalGeneration.from_pretrained(
+                **pretrained_kwargs(BLIP_MODEL_ID, weights=True),
+                device_map="auto"
+            )
+        return _blip_model
+
+
+def warm_up(include_models: bool = True) -> None:
+    """
+    Loads the preprocessors and, unless told otherwise, the models, so that
+    the first generation doesn't pay for it. Meant to run in the background
+    while the GUI is already usable.
+
+    Args:
+        include_models (bool): False to only load the (light) preprocessors,
+            e.g. when a model server already holds the models
+    """
+    get_flan_tokenizer()
+    get_blip_processor()
+    if include_models:
+        get_flan_model()
+        get_blip_model()
+
+
+def compact_embeddings(features) -> list:
+    """
+    Turns a (batch, hidden) tensor of pooled encoder features into compact
+    embeddings: randomly projected to EMBEDDING_DIM, L2-normalized, float16.
+
+    Returns:
+        list: one numpy.ndarray embedding per row
+    """
+    import numpy as np
+
+    features = features.detach().float().cpu().numpy()
+    hidden_size = features.shape[1]
+    if hidden_size not in _projections:
+        rng = np.random.default_rng(EMBEDDING_SEED)
+        _projections[hidden_size] = rng.standard_normal(
+            (hidden_size, EMBEDDING_DIM), dtype=np.float32
+        ) / np.sqrt(EMBEDDING_DIM)
+
+    projected = features @ _projections[hidden_size]
+    projected /= np.maximum(np.linalg.norm(projected, axis=1, keepdims=True), 1e-12)
+    return list(projected.astype(np.float16))
+
+
+class _FirstOutputHook:
+    """
+    Forward hook keeping the output of the first call of a module, e.g. the
+    encoder output computed once at the start of `generate`.
+    """
+    def __init__(self, module) -> None:
+        self.output = None
+        self._handle = module.register_forward_hook(self)
+
+    def __call__(self, module, args, output) -> None:
+        if self.output is None:
+            self.output = output
+
+    def remove(self) -> None:
+        self._handle.remove()
+
+
+class FilenameStoppingCriteria:
+    """
+    Stopping criterion ending the generation of a filename at a sentence
+    punctuation token, or once more than `max_words` words were started.
+    Vectorized over the batch: two lookups in precomputed vocabulary masks
+    per step, no decoding.
+    """
+    def __init__(self, word_start_mask, stop_mask, max_words: int) -> None:
+        self.word_start_mask = word_start_mask
+        self.stop_mask = stop_mask
+        self.max_words = max_words
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = self.stop_mask[input_ids[:, -1]]
+        return done | (self.word_start_mask[input_ids].sum(dim=1) > self.max_words)
+
+
+class NoRepeatTrigramLogitsProcessor:
+    """
+    Bans the tokens that would repeat a trigram already generated, exactly
+    like `no_repeat_ngram_size=3`, but vectorized over the whole batch
+    instead of building n-gram tables in Python for each hypothesis at each
+    step.
+    """
+    def __call__(self, input_ids, scores):
+        import torch
+
+        if input_ids.shape[1] < 3:
+            return scores
+
+        # Positions where the last two tokens already appeared in a row: the
+        # token that followed them there is banned
+        matches = (input_ids[:, :-2] == input_ids[:, -2:-1]) & (input_ids[:, 1:-1] == input_ids[:, -1:])
+        followers = input_ids[:, 2:]
+        banned = torch.zeros(scores.shape, dtype=torch.int32, device=scores.device)
+        banned.scatter_add_(1, followers, matches.to(torch.int32))
+        return scores.masked_fill(banned > 0, -float("inf"))
+
+
+def filename_masks(device):
+    """
+    Returns the (word_start_mask, stop_mask) boolean tensors over the FLAN
+    vocabulary: tokens starting a new word, and tokens ending a filename.
+    Computed once from the tokenizer vocabulary.
+    """
+    import torch
+
+    global _filename_masks
+    if _filename_masks is None:
+        tokenizer = get_flan_tokenizer()
+        vocab_size = max(len(tokenizer), get_flan_model().config.vocab_size)
+        word_start_mask = torch.zeros(vocab_size, dtype=torch.bool)
+        stop_mask = torch.zeros(vocab_size, dtype=torch.bool)
+        for token, token_id in tokenizer.get_vocab().items():
+            word_start_mask[token_id] = token.startswith("▁") and token != "▁"
+            stop_mask[token_id] = token.lstrip("▁") in STOP_TOKENS
+        _filename_masks = (word_start_mask, stop_mask)
+    return tuple(mask.to(device) for mask in _filename_masks)
+
+
+def clean_generated_name(text: str) -> str:
+    """
+    Trims a dynamically decoded name to MAX_NAME_WORDS words (the stopping
+    criterion lets the first token of the next word through) and strips the
+    ending punctuation.
+    """
+    return " ".join(text.split()[:MAX_NAME_WORDS]).rstrip("".join(STOP_TOKENS) + ", ")
+
+
+def generate_text_names(input_ids_list: list, max_time: float = None, fast: bool = False) -> list:
+    """
+    Generates a filename for each of the given FLAN inputs, in one batch.
+
+    Args:
+        input_ids_list (list): (1, n) input IDs tensors, of any length n
+        max_time (float): seconds after which the generation is cut short
+        fast (bool): cheaper decoding (no n-gram blocking, shorter minimum
+            length), for files running out of time budget
+
+    Returns:
+        list: the Generation of each input, in the same order as the inputs.
+            The embedding is the mean of the encoder output over the input.
+    """
+    if not input_ids_list:
+        return []
+
+    import torch
+    from torch.nn.utils.rnn import pad_sequence
+
+    tokenizer = get_flan_tokenizer()
+    flan_model = get_flan_model()
+
+    # Right-padding the inputs to the longest one, masking out the padding
+    sequences = [input_ids[0] for input_ids in input_ids_list]
+    input_ids = pad_sequence(sequences, batch_first=True, padding_value=tokenizer.pad_token_id)
+    attention_mask = torch.zeros_like(input_ids)
+    for row, sequence in enumerate(sequences):
+        attention_mask[row, :len(sequence)] = 1
+
+    # Move inputs to the same device as flan_model
+    input_ids = input_ids.to(flan_model.device)
+    attention_mask = attention_mask.to(flan_model.device)
+
+    hyper_params = {
+        "max_length": 25,
+        "do_sample": False,  # Deterministic output for reliability
+        "repetition_penalty": 1.5,  # Penalize repetitive tokens
+        "max_time": max_time
+    }
+    if DYNAMIC_DECODING:
+        from transformers import LogitsProcessorList, StoppingCriteriaList
+
+        word_start_mask, stop_mask = filename_masks(flan_model.device)
+        hyper_params["min_new_tokens"] = 2
+        hyper_params["stopping_criteria"] = StoppingCriteriaList([
+            FilenameStoppingCriteria(word_start_mask, stop_mask, MAX_NAME_WORDS)
+        ])
+        if not fast:
+            # Avoid repeated phrases, cheaper than no_repeat_ngram_size=3
+            hyper_params["logits_processor"] = LogitsProcessorList([NoRepeatTrigramLogitsProcessor()])
+    else:
+        hyper_params["min_length"] = 5 if fast else 10
+        hyper_params["no_repeat_ngram_size"] = 0 if fast else 3  # Avoid repeated phrases
+
+    # Keeping the encoder output from the generation, no extra forward pass
+    encoder_hook = _FirstOutputHook(flan_model.get_encoder())
+    start = monotonic()
+    try:
+        output_ids = flan_model.generate(input_ids, attention_mask=attention_mask, **hyper_params)
+    finally:
+        encoder_hook.remove()
+    timed_out = max_time is not None and monotonic() - start >= max_time
+
+    # Mean pooling of the encoder output, ignoring the padding
+    hidden_states = encoder_hook.output[0]
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1)
+
+    texts = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+    if DYNAMIC_DECODING:
+        texts = [clean_generated_name(text) for text in texts]
+
+    # Decoded tokens, without the decoder start token and the final padding
+    decode_steps = (output_ids[:, 1:] != tokenizer.pad_token_id).sum(dim=1).tolist()
+
+    return [
+        Generation(text, embedding, steps, timed_out)
+        for text, embedding, steps in zip(texts, compact_embeddings(pooled), decode_steps)
+    ]
+
+
+def generate_image_captions(images: list, max_time: float = None, fast: bool = False) -> list:
+    """
+    Generates a caption for each of the given images, in one batch.
+
+    Args:
+        images (list): the RGB PIL.Image objects to caption
+        max_time (float): seconds after which the generation is cut short
+        fast (bool): greedy decoding instead of beam search, for images
+            running out of time budget
+
+    Returns:
+        list: the Generation of each image, in the same order as the images.
+            The embedding is the pooled output of the vision model.
+    """
+    if not images:
+        return []
+
+    blip_processor = get_blip_processor()
+    blip_model = get_blip_model()
+
+    inputs = blip_processor(images, return_tensors="pt")
+
+    # Move inputs to the same device as blip_model
+    inputs = inputs.to(blip_model.device)
+
+    hyper_params = {
+        "do_sample": False,          # No sampling for deterministic results
+        "num_beams": 8,              # Beam search to improve reliability
+        "repetition_penalty": 1.3,   # Higher repetition penalty
+        "no_repeat_ngram_size": 3,   # Avoid repeating the 3 same words
+        "min_length": 10,
+        "max_length": 25,
+        "max_time": max_time
+        }
+    if fast:
+        hyper_params["num_beams"] = 1
+    # Keeping the vision features from the generation, no extra forward pass
+    vision_hook = _FirstOutputHook(blip_model.vision_model)
+    start = monotonic()
+    try:
+        out = blip_model.generate(**inputs, **hyper_params)
+    finally:
+        vision_hook.remove()
+    timed_out = max_time is not None and monotonic() - start >= max_time
+
+    captions = blip_processor.batch_decode(out, skip_special_tokens=True)
+    embeddings = compact_embeddings(vision_hook.output.pooler_output)
+    return [
+        Generation(caption, embedding, timed_out=timed_out)
+        for caption, embedding in zip(captions, embeddings)
+    ]
+
+
+def export_bundle() -> None:
+    """
+    Saves the tokenizer, processor and models into the local bundle directory,
+    with safetensors weights and their configs, so that `main_window.spec` can
+    ship them and later loads never need the hub.
+    """
+    for model_id, preprocessor, model in (
+        (FLAN_MODEL_ID, get_flan_tokenizer(), get_flan_model()),
+        (BLIP_MODEL_ID, get_blip_processor(), get_blip_model())
+    ):
+        local_path = bundle_path(model_id)
+        print(f"Exporting {model_id} to {local_path}")
+        preprocessor.save_pretrained(local_path)
+        model.save_pretrained(local_path, safe_serialization=True)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["export"]:
+        export_bundle()
+    else:
+        print("Usage: python models.py export")
@@ -7,16 +7,24 @@ from PyQt6.QtWidgets import (
     QDialog,
     QProgressBar,
     QVBoxLayout,
-    QTextEdit,
+    QPlainTextEdit,
     QHBoxLayout,
     QPushButton
 )
 from PyQt6.QtGui import QTextCursor
-from PyQt6.QtCore import pyqtSlot
+from PyQt6.QtCore import pyqtSlot, QTimer
+from collections import deque
+from threading import Lock
 
 import sys
 
 
+# Lines kept in the details area, older lines are discarded
+MAX_LOG_LINES = 5000
+# Interval between two flushes of the buffered log to the details area (ms)
+LOG_FLUSH_INTERVAL = 100
+
+
 class ProgressBarWindow(QDialog):
     """
     A simple progress bar window to represent the progress of the current
@@ -29,8 +37,10 @@ class ProgressBarWindow(QDialog):
         self.progress_bar = QProgressBar()
         self.progress_bar.setRange(0, 100)  # Example range
 
-        self.details_text_edit = QTextEdit()
+        self.details_text_edit = QPlainTextEdit()
         self.details_text_edit.setReadOnly(True)  # Set to read-only mode
+        # Acts as a ring buffer: the oldest lines are dropped past the limit
+        self.details_text_edit.setMaximumBlockCount(MAX_LOG_LINES)
         self.details_text_edit.show()
         self.visible_details = True
 
@@ -60,18 +70,24 @@ class ProgressBarWindow(QDialog):
         layout.addLayout(buttons_layout)
 
 
-        # Redirect STDOUT to the QTextEdit widget
-        sys.stdout = EmittingStream(text_written=self._append_text)
+        # Redirect STDOUT to a buffer, periodically flushed to the widget
+        self.log_sink = BufferedLogSink()
+        sys.stdout = self.log_sink
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self._flush_log)
+        self.log_timer.start(LOG_FLUSH_INTERVAL)
 
-    def _append_text(self, text):
+    @pyqtSlot()
+    def _flush_log(self):
         """
-        Adds the given text into the textedit widget and sets up the cursor
-        at the end.
+        Adds all the text buffered since the last flush into the details
+        widget in one insertion, and sets up the cursor at the end.
         """
-        # self.details_text_edit.clear()
-        cursor = self.details_text_edit.textCursor()
-        cursor.movePosition(QTextCursor.MoveOperation.End)
-        cursor.insertText(text)
+        text = self.log_sink.drain()
+        if text == "":
+            return
+        self.details_text_edit.moveCursor(QTextCursor.MoveOperation.End)
+        self.details_text_edit.insertPlainText(text)
         self.details_text_edit.ensureCursorVisible()
 
     @pyqtSlot(int)
@@ -83,6 +99,7 @@ class ProgressBarWindow(QDialog):
         self.show()
         self.raise_()  # Bring the window to the front
         self.progress_bar.setValue(value)
+        self._flush_log()
 
     @pyqtSlot()
     def show_details_widget(self):
@@ -108,13 +125,37 @@ class ProgressBarWindow(QDialog):
             self.close()
 
 
-# TODO Not sure I like this, could need overhaul ?
-class EmittingStream:
-    def __init__(self, text_written):
-        self.text_written = text_written
+class BufferedLogSink:
+    """
+    A thread-safe, file-like object buffering written text until the GUI
+    thread drains it. Any thread can write to it, as it never touches
+    widgets. The buffer is bounded: if it isn't drained in time, the oldest
+    fragments are dropped and their count is reported on the next drain.
+    """
+    def __init__(self, max_fragments: int = 10000):
+        self._fragments = deque(maxlen=max_fragments)
+        self._dropped = 0
+        self._lock = Lock()
 
     def write(self, text):
-        self.text_written(text)
+        with self._lock:
+            if len(self._fragments) == self._fragments.maxlen:
+                self._dropped += 1
+            self._fragments.append(text)
+        return len(text)
 
     def flush(self):
-        pass # Not flushing for now
+        pass # Flushed to the widget by the GUI thread
+
+    def drain(self) -> str:
+        """
+        Returns all the buffered text and empties the buffer.
+        """
+        with self._lock:
+            text = "".join(self._fragments)
+            self._fragments.clear()
+            dropped = self._dropped
+            self._dropped = 0
+        if dropped:
+            text = f"[{dropped} log messages dropped]\n" + text
+        return text
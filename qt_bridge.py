@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+This is the qt_bridge module, used to drive the asyncio core service (see
+the service module) from a Qt application. The service runs on its own
+event loop, in a background thread, and its results are delivered to the
+GUI thread through a queued signal, so the Qt event loop never blocks.
+"""
+import asyncio
+from threading import Thread, Event
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+import service
+
+
+class ServiceBridge(QObject):
+    """
+    Runs a TrueNameService in a background thread and emits its results as
+    Qt signals. The signals are emitted from the background thread, so slots
+    of objects living in the GUI thread are called through queued
+    connections, in the GUI thread.
+
+    Typical use:
+        bridge = ServiceBridge(rename=False, parent=window)
+        bridge.result_ready.connect(window.on_result)
+        bridge.start()
+        bridge.submit(paths, close=True)
+
+    Signals:
+        result_ready (service.ServiceResult): a file was processed
+        finished: all the results were delivered, or the run was cancelled
+    """
+    result_ready = pyqtSignal(object)
+    finished = pyqtSignal()
+
+    def __init__(self, parent=None, **service_options) -> None:
+        """
+        Args:
+            parent (QObject): the parent of the bridge
+            **service_options: the arguments of the TrueNameService
+        """
+        super().__init__(parent)
+        self.service_options = service_options
+        self.service = None
+        self._ready = Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Starts a new run of the service in the background thread. A bridge
+        can be started again once its previous run is finished.
+        """
+        if self.is_running():
+            raise RuntimeError("The service is already running")
+        self._ready.clear()
+        self._thread = Thread(target=asyncio.run, args=(self._run(),), daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, paths: list, close: bool = False):
+        """
+        Queues the given files without blocking the calling thread: the
+        backpressure of the service only holds the background thread.
+
+        Args:
+            paths (list): file paths, or File objects
+            close (bool): whether to close the service once they're queued
+
+        Returns:
+            concurrent.futures.Future: the future of the number of files queued
+        """
+        return self.service.submit_threadsafe(list(paths), close)
+
+    def close(self) -> None:
+        """
+        Tells the service no more files will be submitted: `finished` is
+        emitted once the submitted files are processed.
+        """
+        self.service.close_threadsafe()
+
+    def cancel(self) -> None:
+        """
+        Cancels the current run: `finished` is emitted without the results
+        not delivered yet.
+        """
+        if self.service is not None:
+            self.service.cancel_threadsafe()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits for the background thread to finish.
+
+        Returns:
+            bool: True if it finished before the timeout
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.is_running()
+
+    async def _run(self) -> None:
+        """
+        Background thread: runs the service and emits its results.
+        """
+        self.service = service.TrueNameService(**self.service_options)
+        try:
+            async with self.service:
+                self._ready.set()
+                async for result in self.service:
+                    self.result_ready.emit(result)
+        except Exception as e:
+            print(f"Error: {e} when running the TrueName service")
+        finally:
+            # In case the service failed to start
+            self._ready.set()
+            self.finished.emit()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+This is the resources module, used to locate the files shipped with the
+application, both in the dev version and in the PyInstaller distribution,
+as well as the user state directory.
+"""
+import sys
+from os import environ
+from os.path import abspath, join, expanduser
+
+
+# Per-user directory for the state kept between sessions
+STATE_DIR = environ.get("TRUENAME_STATE_DIR", join(expanduser("~"), ".truename"))
+
+
+def get_resource_path(relative_path):
+    """
+    Get correct absolute path to resource, works for dev version (script) and
+    for distribution version with PyInstaller.
+    """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEIPASS
+        base_path = sys._MEIPASS
+    except Exception:
+        # No _MEIPASS, assuming dev version & using the basic absolute path
+        base_path = abspath(".")
+
+    return join(base_path, relative_path)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+This is the service module, the asyncio core of TrueName, independent from
+Qt. A TrueNameService takes file paths, runs them through extraction, name
+generation and (optionally) renaming, and streams the results back as an
+async iterator.
+
+At most `max_in_flight` files are being processed at once, and `submit`
+waits while the input queue is full, so memory stays bounded whatever the
+number of submitted files. The blocking work runs in executors:
+    - text extraction in worker processes (see the extraction module)
+    - metadata, image decoding, tokenization, session records and renaming
+      in a single local thread, as fitz isn't thread-safe
+    - name generation in a single model thread, as the models run one
+      batch at a time anyway
+
+The headless module drives it from the command line, and the qt_bridge
+module from the GUI event loop.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import cpu_count
+from time import monotonic
+from typing import NamedTuple
+
+import deadline
+import extraction
+import file
+import metadata
+from clean_filename import dynamic_rename
+
+
+# Result statuses
+NAMED = "named"
+RENAMED = "renamed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+class ServiceResult(NamedTuple):
+    """
+    The outcome of the processing of a submitted file.
+
+    Attributes:
+        file (file.File): the processed File object, holding the new name and path
+        status (str): NAMED, RENAMED, SKIPPED (unsupported type or no name
+            found) or FAILED
+        error (str): the error message when FAILED, empty otherwise
+    """
+    file: file.File
+    status: str
+    error: str = ""
+
+
+class TrueNameService:
+    """
+    Processes submitted files concurrently, with bounded in-flight work.
+
+    Typical use, from a coroutine (submitting waits for the results to be
+    consumed, so both run in separate tasks):
+        async with TrueNameService(rename=True) as service:
+            asyncio.create_task(service.submit(paths, close=True))
+            async for result in service:
+                print(result.file.new_path)
+
+    Other threads can submit files, close the service and cancel the
+    processing with `submit_threadsafe`, `close_threadsafe` and
+    `cancel_threadsafe`.
+
+    Attributes:
+        max_in_flight (int): the maximum number of files processed at once
+        rename (bool): whether the named files are renamed on disk
+        metadata_first (bool): whether files with good enough metadata skip
+            the models (see metadata.METADATA_FIRST)
+        session_state (session.SessionState): the state to restore unchanged
+            files from and to record new names in, None to skip it
+        metadata_hits (int): the number of files named from their metadata
+        metadata_time (float): the seconds spent looking up metadata
+        generated_count (int): the number of files that went through the models
+        models_time (float): the seconds spent in the models (or falling back)
+    """
+    def __init__(self, max_in_flight: int = 4, rename: bool = False,
+                 metadata_first: bool = metadata.METADATA_FIRST, session_state=None) -> None:
+        self.max_in_flight = max_in_flight
+        self.rename = rename
+        self.metadata_first = metadata_first
+        self.session_state = session_state
+        self._loop = None
+        self._inputs = None
+        self._results = None
+        self._workers = []
+        self._closing = False
+        self._cancelled = False
+        self._exhausted = False
+        self._finisher = None
+        self._file_count = 0
+        # The files submitted and not processed yet, and the time budget of
+        # the batch they form
+        self._pending = 0
+        self._budget = None
+        # Metadata-first fast path statistics, updated in the executors
+        self.metadata_hits = 0
+        self.metadata_time = 0.0
+        self.generated_count = 0
+        self.models_time = 0.0
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback) -> None:
+        await self.shutdown()
+
+    def __aiter__(self):
+        return self.results()
+
+    async def start(self) -> None:
+        """
+        Starts the executors and the worker tasks, on the running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._inputs = asyncio.Queue(maxsize=self.max_in_flight)
+        self._results = asyncio.Queue(maxsize=self.max_in_flight)
+        self._extraction_workers = min(self.max_in_flight, cpu_count() or 1)
+        self._extraction_pool = ProcessPoolExecutor(max_workers=self._extraction_workers)
+        # One document per worker at a time, so the timeout of a document
+        # never includes waiting behind another one
+        self._extraction_slots = asyncio.Semaphore(self._extraction_workers)
+        self._local_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="truename_local")
+        self._model_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="truename_model")
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.max_in_flight)]
+
+    async def submit(self, paths: list, close: bool = False) -> int:
+        """
+        Queues the given files for processing, waiting while the input queue
+        is full. Stops early if the service is cancelled.
+
+        Args:
+            paths (list): file paths, or File objects (e.g. already extracted,
+                or already named: those keep their name)
+            close (bool): whether to close the service once they're queued
+
+        Returns:
+            int: the number of files actually queued
+        """
+        if self._closing:
+            raise RuntimeError("Can't submit files to a closed service")
+
+        queued = 0
+        for path in paths:
+            if self._cancelled:
+                break
+            # Files submitted while the service is idle start a new batch
+            if self._pending == 0:
+                self._budget = deadline.batch_budget()
+            self._budget.extend(deadline.BATCH_TIME_PER_FILE)
+            self._pending += 1
+            await self._inputs.put(path)
+            queued += 1
+        if close:
+            await self.close()
+        return queued
+
+    def submit_threadsafe(self, paths: list, close: bool = False):
+        """
+        Same as `submit`, from any thread.
+
+        Returns:
+            concurrent.futures.Future: the future of the number of files queued
+        """
+        return asyncio.run_coroutine_threadsafe(self.submit(paths, close), self._loop)
+
+    async def close(self) -> None:
+        """
+        Tells the service no more files will be submitted: the results
+        iterator ends once the files already submitted are processed.
+        Doesn't wait for them, so it can be awaited before consuming.
+        """
+        if self._closing:
+            return
+        self._closing = True
+        self._finisher = asyncio.create_task(self._finish())
+
+    def close_threadsafe(self) -> None:
+        """
+        Same as `close`, from any thread.
+        """
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop)
+
+    async def _finish(self) -> None:
+        """
+        Stops the workers once the input queue is drained, then ends the
+        results iterator.
+        """
+        for _ in self._workers:
+            await self._inputs.put(None)
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if not self._cancelled:
+            await self._results.put(None)
+
+    def cancel(self) -> None:
+        """
+        Cancels the processing: the queued files are dropped, the results
+        not consumed yet are discarded, and the results iterator ends.
+        A file already in an executor can't be interrupted, but its result
+        is ignored.
+        """
+        if self._loop is None or self._cancelled or self._exhausted:
+            return
+        self._cancelled = True
+        self._closing = True
+        for worker in self._workers:
+            worker.cancel()
+        for queue in (self._inputs, self._results):
+            while not queue.empty():
+                queue.get_nowait()
+        self._results.put_nowait(None)
+
+    def cancel_threadsafe(self) -> None:
+        """
+        Same as `cancel`, from any thread.
+        """
+        self._loop.call_soon_threadsafe(self.cancel)
+
+    async def results(self):
+        """
+        Yields a ServiceResult for each processed file, as soon as it's ready
+        (not in submission order), until the service is closed and all the
+        files are processed, or it's cancelled.
+        """
+        while True:
+            result = await self._results.get()
+            if result is None:
+                self._exhausted = True
+                # Letting other iterators of the results end too
+                self._results.put_nowait(None)
+                return
+            yield result
+
+    async def shutdown(self) -> None:
+        """
+        Stops the service, cancelling the processing unless all the results
+        were consumed, then releases the executors and saves the session
+        state.
+        """
+        if self._loop is None:
+            return
+        self.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self._finisher is not None:
+            await self._finisher
+        # A worker may still be stuck on a document of a cancelled run
+        extraction.kill_pool(self._extraction_pool)
+        self._local_pool.shutdown(wait=False, cancel_futures=True)
+        self._model_pool.shutdown(wait=False, cancel_futures=True)
+        if self.session_state is not None:
+            self.session_state.save()
+
+    async def _work(self) -> None:
+        """
+        Worker task: processes the queued files one by one, until it gets
+        the None sentinel.
+        """
+        while True:
+            path = await self._inputs.get()
+            if path is None:
+                return
+            try:
+                result = await self._process(path)
+            finally:
+                self._pending -= 1
+            await self._results.put(result)
+
+    async def _process(self, path) -> ServiceResult:
+        """
+        Runs a file through extraction, generation and renaming.
+        Errors are captured in the result instead of being raised.
+        """
+        current_file = path if isinstance(path, file.File) else file.File(path)
+        self._file_count += 1
+        file_number = self._file_count
+        file_type = current_file.file_type.lower()
+        if file_type not in file.file_formats["text_formats"] + file.file_formats["image_formats"]:
+            # Not even read, nor recorded in the session state
+            return ServiceResult(current_file, SKIPPED)
+
+        try:
+            # Files already named keep their name. Unchanged files restored
+            # without a name (never generated, or skipped) are processed again.
+            if current_file.new_name == "" and not (
+                await self._restore(current_file) and current_file.new_name != ""
+            ):
+                named, candidate = await self._run_local(self._name_from_metadata, current_file)
+                if not named:
+                    # The name is kept if only the bytes changed, not the text
+                    if not await self._extract(current_file):
+                        await self._run(self._model_pool, self._generate, current_file, file_number, candidate)
+                if self.session_state is not None:
+                    await self._run_local(self.session_state.record_name, current_file)
+
+            if current_file.new_path == "":
+                return ServiceResult(current_file, SKIPPED)
+            if not self.rename:
+                return ServiceResult(current_file, NAMED)
+            # Renames all run in the local thread, one at a time, so files
+            # bound to the same name get distinct "_(n)" suffixes
+            current_file.new_path = await self._run_local(
+                dynamic_rename, current_file.original_path, current_file.new_path
+            )
+            return ServiceResult(current_file, RENAMED)
+        except Exception as e:
+            print(f"Error: {e} when processing file at path [{current_file.original_path}]")
+            return ServiceResult(current_file, FAILED, str(e))
+
+    async def _restore(self, current_file) -> bool:
+        """
+        Restores the name of an unchanged file from the session state.
+        """
+        if self.session_state is None:
+            return False
+        return await self._run_local(self.session_state.restore, current_file)
+
+    async def _extract(self, current_file) -> bool:
+        """
+        Extracts the content of the file, if not done yet: text in worker
+        processes, then tokenized locally, images locally.
+
+        Returns:
+            bool: True if the session state gave the file its previous name
+                back, its text being unchanged
+        """
+        if current_file.extracted:
+            return False
+        if current_file.file_type.lower() in file.file_formats["text_formats"]:
+            result = await self._extract_text(current_file.original_path)
+            await self._run_local(current_file.set_extraction_result, result)
+            await self._run_local(file.tokenize_files, [current_file])
+        else:
+            await self._run_local(current_file.extract_image_content)
+
+        if self.session_state is None:
+            return False
+        return await self._run_local(self.session_state.record, current_file)
+
+    async def _extract_text(self, path: str) -> extraction.ExtractionResult:
+        """
+        Extracts the text of a document in the worker processes, large
+        documents split into page ranges, within
+        deadline.EXTRACTION_TIME_BUDGET. On timeout, the worker processes are
+        killed and replaced (see `extraction.kill_pool`).
+        """
+        async with self._extraction_slots:
+            # Once more if the pool was killed because of another document
+            for _ in range(2):
+                pool = self._extraction_pool
+                try:
+                    # Large documents are opened to count their pages
+                    futures = await self._run_local(extraction.submit_document, pool, path)
+                    results = await asyncio.wait_for(
+                        asyncio.gather(*(asyncio.wrap_future(future) for future in futures)),
+                        timeout=deadline.EXTRACTION_TIME_BUDGET
+                    )
+                    return extraction.join_results(path, results)
+                except asyncio.TimeoutError:
+                    if pool is self._extraction_pool:
+                        self._extraction_pool = ProcessPoolExecutor(max_workers=self._extraction_workers)
+                        extraction.kill_pool(pool)
+                    return extraction.timeout_result(path, deadline.EXTRACTION_TIME_BUDGET)
+                except BrokenProcessPool as e:
+                    error = str(e)
+                except asyncio.CancelledError:
+                    # The page ranges still queued when the pool is killed
+                    # are cancelled with it, unlike the worker task itself
+                    if self._cancelled or pool is self._extraction_pool:
+                        raise
+                    error = "extraction cancelled with the worker processes"
+                except Exception as e:
+                    return extraction.ExtractionResult(path, "", str(e))
+            return extraction.ExtractionResult(path, "", error)
+
+    def _name_from_metadata(self, current_file) -> tuple:
+        """
+        Runs in the local thread, as fitz isn't thread-safe: looks up the
+        metadata candidate of the file, and names the file from it if it's
+        good enough (and metadata_first is set).
+
+        Returns:
+            tuple: whether the file was named, and its metadata candidate
+        """
+        start = monotonic()
+        candidate = metadata.best_candidate(current_file)
+        named = self.metadata_first and current_file.name_from_metadata(candidate)
+        self.metadata_time += monotonic() - start
+        if named:
+            self.metadata_hits += 1
+            print(f"Named from metadata: [{current_file.new_name}]")
+        return named, candidate
+
+    def _generate(self, current_file, file_number: int, candidate: tuple) -> None:
+        """
+        Runs in the model thread: the time budget of the file only starts
+        once its turn comes. The metadata candidate was looked up in the
+        local thread, so falling back never opens the file here.
+        """
+        start = monotonic()
+        current_file.process_file(file_number, self._budget.child(deadline.FILE_TIME_BUDGET), candidate)
+        self.models_time += monotonic() - start
+        self.generated_count += 1
+
+    def _run(self, executor, function, *args):
+        return self._loop.run_in_executor(executor, function, *args)
+
+    def _run_local(self, function, *args):
+        return self._run(self._local_pool, function, *args)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+This is the session module, used to remember the work done on each file
+across TrueName sessions, so that re-added files are not processed again.
+
+For each path, the session state file records the modification time, size
+and content hash of the file, a digest of its extracted text, and its
+generated name. Re-adding an unchanged file only costs a stat call, and a
+file whose bytes changed but whose text didn't (e.g. re-saved with other
+metadata) keeps its name after extraction.
+"""
+import json
+from hashlib import blake2b
+from os import stat, replace, makedirs
+from os.path import join, dirname
+
+from resources import STATE_DIR
+
+
+SESSION_PATH = join(STATE_DIR, "session.json")
+SESSION_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def content_hash(path: str) -> str:
+    """
+    Returns the hex digest of the bytes of the file at the given path.
+    """
+    digest = blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_hash(data: bytes) -> str:
+    """
+    Returns the hex digest of the given file bytes, the same as
+    `content_hash` for the file they were read from.
+    """
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+def text_digest(text: str) -> str:
+    """
+    Returns the hex digest of the given extracted text.
+    """
+    return blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class SessionState:
+    """
+    The per-path records of the files processed so far, saved as JSON.
+
+    Attributes:
+        path (str): the path to the session state file
+        records (dict): the record of each file, by normalized path
+    """
+    def __init__(self, path: str = SESSION_PATH) -> None:
+        self.path = path
+        self.records = {}
+        self.load()
+
+    def load(self) -> None:
+        """
+        Loads the records from the session state file, if there is one.
+        A missing or unreadable file gives an empty session.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == SESSION_VERSION:
+                self.records = data["files"]
+        except (OSError, ValueError, KeyError) as e:
+            self.records = {}
+            if not isinstance(e, FileNotFoundError):
+                print(f"Error: {e} when loading session at path [{self.path}]")
+
+    def save(self) -> None:
+        """
+        Writes the records to the session state file (atomically, through a
+        temporary file, so a crash never leaves a truncated session).
+        """
+        makedirs(dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": SESSION_VERSION, "files": self.records}, f)
+            replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error: {e} when saving session at path [{self.path}]")
+
+    def restore(self, current_file) -> bool:
+        """
+        Restores the generated name and folder of the given File object if
+        its file is unchanged since it was recorded. Only stats the file,
+        unless its modification time changed while its size didn't: then the
+        content hash tells whether it was actually modified.
+
+        Args:
+            current_file (file.File): the File object to restore
+
+        Returns:
+            bool: True if the file is unchanged and was restored, False if
+                it needs to be (re-)extracted
+        """
+        record = self.records.get(current_file.original_path)
+        if record is None:
+            return False
+
+        try:
+            file_stat = stat(current_file.original_path)
+        except OSError:
+            return False
+
+        if file_stat.st_size != record["size"]:
+            return False
+        if file_stat.st_mtime_ns != record["mtime"]:
+            try:
+                if content_hash(current_file.original_path) != record["content_hash"]:
+                    return False
+            except OSError:
+                return False
+            # Touched but not modified, no need to hash it next time
+            record["mtime"] = file_stat.st_mtime_ns
+
+        if record["new_name"] != "":
+            current_file.new_name = record["new_name"]
+            current_file.folder = record["folder"]
+            current_file.build_new_path()
+        return True
+
+    def record(self, current_file) -> bool:
+        """
+        Records the given File object, just after its content extraction.
+        The name previously recorded for this path is kept, and restored on
+        the File object, if the extracted text is the same as before.
+        Otherwise, it's dropped.
+
+        The content hash computed during extraction is reused (see
+        `file.File.content_hash`), the file is only hashed here without one.
+
+        Args:
+            current_file (file.File): the File object to record
+
+        Returns:
+            bool: True if the previous name was kept
+        """
+        previous = self.records.get(current_file.original_path)
+        try:
+            file_stat = stat(current_file.original_path)
+            file_hash = current_file.content_hash or content_hash(current_file.original_path)
+        except OSError:
+            self.records.pop(current_file.original_path, None)
+            return False
+
+        text = current_file.text_content
+        digest = text_digest(text)
+        # Images have no text, any change of their bytes is a new content
+        kept = (
+            previous is not None and text != ""
+            and previous["text_digest"] == digest and previous["new_name"] != ""
+        )
+        self.records[current_file.original_path] = {
+            "mtime": file_stat.st_mtime_ns,
+            "size": file_stat.st_size,
+            "content_hash": file_hash,
+            "text_digest": digest,
+            "new_name": previous["new_name"] if kept else "",
+            "folder": previous["folder"] if kept else ""
+        }
+        if kept:
+            current_file.new_name = previous["new_name"]
+            current_file.folder = previous["folder"]
+            current_file.build_new_path()
+        return kept
+
+    def record_name(self, current_file) -> None:
+        """
+        Records the generated name and folder of the given File object.
+        """
+        record = self.records.get(current_file.original_path)
+        if record is not None:
+            record["new_name"] = current_file.new_name
+            record["folder"] = current_file.folder
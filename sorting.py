@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+This is the sorting module, used to propose target subfolders for the files
+by clustering their embeddings, computed during the name generation.
+
+The clustering is a vectorized NumPy k-means: each iteration costs
+O(files x clusters), never O(files^2), so it scales to tens of thousands of
+files. Text documents and images are clustered separately, their embeddings
+coming from different models.
+"""
+from collections import Counter
+from math import ceil, sqrt
+from re import split
+
+from clean_filename import secure_filename
+from file import file_formats
+
+
+# Fewer files than this are left in place, there's nothing to sort
+MIN_FILES_TO_SORT = 4
+MAX_FOLDERS = 20
+KMEANS_ITERATIONS = 25
+# Words of the generated names ignored when naming the folders
+STOPWORDS = {
+    "a", "an", "and", "at", "by", "for", "from", "in", "into", "is", "it",
+    "of", "on", "or", "the", "this", "to", "with", "pdf", "png", "jpg",
+    "jpeg", "webp", "file", "document", "image", "picture", "photo"
+}
+
+
+def kmeans(vectors, cluster_count: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0):
+    """
+    Clusters the given vectors with k-means (k-means++ initialization).
+
+    Args:
+        vectors (numpy.ndarray): (n, d) array of vectors
+        cluster_count (int): the number of clusters k
+        iterations (int): the maximum number of Lloyd iterations
+        seed (int): the random seed, for reproducible results
+
+    Returns:
+        tuple: (labels, centroids), the (n,) cluster index of each vector and
+            the (k, d) array of cluster centers
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count = len(vectors)
+    cluster_count = min(cluster_count, count)
+    squared_norms = np.einsum("ij,ij->i", vectors, vectors)
+
+    # k-means++: each new center is drawn proportionally to the squared
+    # distance to the closest center chosen so far
+    centroids = np.empty((cluster_count, vectors.shape[1]), dtype=np.float32)
+    centroids[0] = vectors[rng.integers(count)]
+    closest = squared_norms - 2 * vectors @ centroids[0] + centroids[0] @ centroids[0]
+    for index in range(1, cluster_count):
+        weights = np.maximum(closest, 0)
+        total = weights.sum()
+        choice = rng.choice(count, p=weights / total) if total > 0 else rng.integers(count)
+        centroids[index] = vectors[choice]
+        distances = squared_norms - 2 * vectors @ centroids[index] + centroids[index] @ centroids[index]
+        closest = np.minimum(closest, distances)
+
+    labels = np.full(count, -1)
+    for _ in range(iterations):
+        # Squared distances up to the constant |x|^2 term: |c|^2 - 2 x.c
+        distances = (centroids * centroids).sum(axis=1) - 2 * vectors @ centroids.T
+        new_labels = distances.argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        # Sum of the vectors of each cluster, empty clusters keep their center
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        sizes = np.bincount(labels, minlength=cluster_count)
+        filled = sizes > 0
+        centroids[filled] = sums[filled] / sizes[filled, None]
+
+    return labels, centroids
+
+
+def name_words(name: str) -> set:
+    """
+    Returns the meaningful words of the given filename, lowercase.
+    """
+    return {word for word in split(r"[\W_]+", name.lower())
+            if len(word) > 2 and word not in STOPWORDS and not word.isdigit()}
+
+
+def folder_name(names: list) -> str:
+    """
+    Builds a folder name out of the most common words of the given filenames.
+    """
+    words = Counter()
+    for name in names:
+        # Each word counts once per file
+        words.update(name_words(name))
+    return secure_filename("_".join(word for word, _ in words.most_common(2)))
+
+
+def propose_folders(files: list) -> None:
+    """
+    Clusters the given File objects by embedding, and sets their `folder`
+    attribute to a subfolder named after each cluster, then rebuilds their
+    new path. Text documents and images are clustered separately.
+
+    Files named without the models (e.g. from their metadata) have no
+    embedding: they join the cluster whose names share the most words with
+    theirs, or are left in place if none does. Files without a new name are
+    left in place.
+
+    Args:
+        files (list): the File objects to sort
+    """
+    import numpy as np
+
+    # Files and their embeddings, and the files without embedding
+    groups = {}
+    unembedded = {}
+    for current_file in files:
+        if current_file.new_name == "":
+            continue
+        is_image = current_file.file_type.lower() in file_formats["image_formats"]
+        embedding = current_file.embedding
+        if embedding is None:
+            unembedded.setdefault(is_image, []).append(current_file)
+        else:
+            groups.setdefault(is_image, []).append((current_file, embedding))
+
+    used_names = set()
+    for is_image, group in groups.items():
+        if len(group) < MIN_FILES_TO_SORT:
+            continue
+
+        cluster_count = min(MAX_FOLDERS, ceil(sqrt(len(group) / 2)))
+        vectors = np.stack([embedding for _, embedding in group])
+        labels, _ = kmeans(vectors, cluster_count)
+
+        # (folder name, word counts, size) of each cluster
+        clusters = []
+        for label in np.unique(labels):
+            members = [group[index][0] for index in np.flatnonzero(labels == label)]
+            name = folder_name([member.new_name for member in members]) or "misc"
+
+            # Two clusters may end up with the same words
+            unique_name, count = name, 1
+            while unique_name in used_names:
+                unique_name = f"{name}_({count})"
+                count += 1
+            used_names.add(unique_name)
+
+            for member in members:
+                member.folder = unique_name
+                member.build_new_path()
+
+            words = Counter()
+            for member in members:
+                words.update(name_words(member.new_name))
+            clusters.append((unique_name, words, len(members)))
+
+        for current_file in unembedded.get(is_image, []):
+            words = name_words(current_file.new_name)
+            # Share of the cluster members having each word in common
+            scores = [sum(cluster_words[word] for word in words) / size
+                      for _, cluster_words, size in clusters]
+            best = int(np.argmax(scores))
+            if scores[best] > 0:
+                current_file.folder = clusters[best][0]
+                current_file.build_new_path()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+This is the spill module, storing the bulky content of the files (extracted
+text, images, token IDs, embeddings) out of the File objects, in a temporary SQLite
+database on disk. This keeps the memory used per file small and constant,
+whatever the size of the documents.
+"""
+import sqlite3
+import zlib
+from atexit import register
+from os import close, remove
+from tempfile import mkstemp
+from threading import Lock
+
+
+# Images are only kept at a resolution comfortably above the BLIP input size
+# (384 x 384), which they are resized to before captioning anyway
+IMAGE_MAX_SIDE = 768
+IMAGE_QUALITY = 95
+
+TEXT = "text"
+IMAGE = "image"
+INPUT_IDS = "input_ids"
+EMBEDDING = "embedding"
+
+_store = None
+_store_lock = Lock()
+
+
+class SpillStore:
+    """
+    A key-value store of file contents, kept in a temporary SQLite database
+    deleted when the application exits. Thread-safe.
+    """
+    def __init__(self) -> None:
+        handle, self.path = mkstemp(prefix="truename_", suffix=".sqlite")
+        close(handle)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # The data is disposable, trading durability for speed
+        self._conn.execute("PRAGMA journal_mode = OFF")
+        self._conn.execute("PRAGMA synchronous = OFF")
+        self._conn.execute(
+            "CREATE TABLE content (key INTEGER, kind TEXT, data BLOB, PRIMARY KEY (key, kind))"
+        )
+        register(self.close)
+
+    def put(self, key: int, kind: str, data: bytes) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO content VALUES (?, ?, ?)", (key, kind, data))
+
+    def get(self, key: int, kind: str):
+        """
+        Returns the stored bytes, or None if there are none.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM content WHERE key = ? AND kind = ?", (key, kind)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def delete(self, key: int, kind: str = None) -> None:
+        """
+        Deletes the given kind of content of a key, or all its content.
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            if kind is None:
+                self._conn.execute("DELETE FROM content WHERE key = ?", (key,))
+            else:
+                self._conn.execute("DELETE FROM content WHERE key = ? AND kind = ?", (key, kind))
+
+    def close(self) -> None:
+        """
+        Closes and deletes the database.
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            self._conn.close()
+            self._conn = None
+        try:
+            remove(self.path)
+        except OSError:
+            pass
+
+    def put_text(self, key: int, text: str) -> None:
+        self.put(key, TEXT, zlib.compress(text.encode("utf-8", "surrogatepass"), 1))
+
+    def get_text(self, key: int) -> str:
+        data = self.get(key, TEXT)
+        return "" if data is None else zlib.decompress(data).decode("utf-8", "surrogatepass")
+
+    def put_image(self, key: int, image) -> None:
+        """
+        Stores a JPEG copy of the given PIL image, downscaled to IMAGE_MAX_SIDE.
+        """
+        from io import BytesIO
+
+        image = image.copy()
+        image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=IMAGE_QUALITY)
+        self.put(key, IMAGE, buffer.getvalue())
+
+    def get_image(self, key: int):
+        """
+        Returns the stored RGB PIL image, or None.
+        """
+        from io import BytesIO
+        from PIL import Image
+
+        data = self.get(key, IMAGE)
+        return None if data is None else Image.open(BytesIO(data)).convert("RGB")
+
+    def put_input_ids(self, key: int, input_ids) -> None:
+        """
+        Stores a (1, n) tensor of token IDs as int32 bytes.
+        """
+        import numpy as np
+
+        self.put(key, INPUT_IDS, input_ids.cpu().numpy().astype(np.int32).tobytes())
+
+    def get_input_ids(self, key: int):
+        """
+        Returns the stored (1, n) tensor of token IDs, or None.
+        """
+        import numpy as np
+        import torch
+
+        data = self.get(key, INPUT_IDS)
+        if data is None:
+            return None
+        return torch.from_numpy(np.frombuffer(data, dtype=np.int32).astype(np.int64)).unsqueeze(0)
+
+    def put_embedding(self, key: int, embedding) -> None:
+        """
+        Stores a 1-D embedding as float16 bytes.
+        """
+        import numpy as np
+
+        self.put(key, EMBEDDING, np.asarray(embedding, dtype=np.float16).tobytes())
+
+    def get_embedding(self, key: int):
+        """
+        Returns the stored float16 embedding (read-only numpy array), or None.
+        """
+        import numpy as np
+
+        data = self.get(key, EMBEDDING)
+        return None if data is None else np.frombuffer(data, dtype=np.float16)
+
+
+def get_store() -> SpillStore:
+    """
+    Returns the spill store of the application, creating it on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SpillStore()
+        return _store
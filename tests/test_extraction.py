@@ -0,0 +1,60 @@
+"""
+Tests of the extraction module, with a stand-in worker function instead of
+fitz, so they run without the PDF dependencies.
+"""
+import unittest
+from time import monotonic, sleep
+from unittest import mock
+
+import extraction
+
+
+# Seconds a stuck document would take, far beyond the timeout
+STUCK_SECONDS = 60
+TIMEOUT = 1.0
+
+
+def fake_extract(path: str) -> tuple:
+    """
+    Stand-in for `extraction.extract_document`, run in the worker processes.
+    """
+    if path.startswith("stuck"):
+        sleep(STUCK_SECONDS)
+    return f"text of {path}", f"hash of {path}"
+
+
+def fake_submit_document(pool, path: str) -> list:
+    """
+    Stand-in for `extraction.submit_document`, a single range per document.
+    """
+    return [pool.submit(fake_extract, path)]
+
+
+class ExtractTextsTimeoutTest(unittest.TestCase):
+    def extract(self, paths: list, max_workers: int) -> list:
+        with mock.patch.object(extraction, "submit_document", fake_submit_document):
+            return list(extraction.extract_texts(paths, max_workers=max_workers, timeout=TIMEOUT))
+
+    def test_queued_documents_survive_the_pool_kill(self):
+        # The stuck documents occupy all the workers, the others are queued
+        # when the pool is killed, and are cancelled with it
+        paths = ["stuck_1", "stuck_2", "a", "b", "c"]
+        start = monotonic()
+        results = self.extract(paths, max_workers=2)
+
+        self.assertLess(monotonic() - start, STUCK_SECONDS / 2)
+        self.assertEqual([result.path for result in results], paths)
+        for result in results[:2]:
+            self.assertTrue(result.error.startswith(extraction.TIMEOUT_ERROR))
+        for path, result in zip(paths[2:], results[2:]):
+            self.assertEqual(result, extraction.ExtractionResult(path, f"text of {path}", "", f"hash of {path}"))
+
+    def test_single_stuck_document(self):
+        results = self.extract(["stuck"], max_workers=1)
+
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0].error.startswith(extraction.TIMEOUT_ERROR))
+
+
+if __name__ == "__main__":
+    unittest.main()
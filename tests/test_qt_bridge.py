@@ -0,0 +1,79 @@
+"""
+Tests of the qt_bridge module, skipped if PyQt6 isn't installed. The
+submitted files are of unsupported types, so the models are never run.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from importlib.util import find_spec
+
+import service
+
+
+# Seconds before a run is considered stuck
+RUN_TIMEOUT = 30
+
+
+@unittest.skipUnless(find_spec("PyQt6"), "PyQt6 isn't installed")
+class ServiceBridgeTest(unittest.TestCase):
+    def setUp(self):
+        from PyQt6.QtCore import QCoreApplication
+
+        self.app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.paths = []
+        for name in ("a.txt", "b.txt", "c.txt"):
+            path = os.path.join(directory.name, name)
+            with open(path, "w") as f:
+                f.write(name)
+            self.paths.append(path)
+
+    def run_bridge(self, submit) -> tuple:
+        """
+        Starts a bridge, calls `submit` with it, and runs the event loop
+        until it's finished.
+
+        Returns:
+            tuple: the delivered results, and whether `finished` was emitted
+        """
+        from PyQt6.QtCore import QEventLoop, QTimer
+        import qt_bridge
+
+        bridge = qt_bridge.ServiceBridge()
+        results = []
+        finished = []
+        loop = QEventLoop()
+        bridge.result_ready.connect(results.append)
+        bridge.finished.connect(lambda: finished.append(True))
+        bridge.finished.connect(loop.quit)
+        QTimer.singleShot(RUN_TIMEOUT * 1000, loop.quit)
+
+        bridge.start()
+        submit(bridge)
+        loop.exec()
+        self.app.processEvents()
+        self.assertTrue(bridge.wait(RUN_TIMEOUT))
+        return results, finished == [True]
+
+    def test_results_then_finished(self):
+        results, finished = self.run_bridge(lambda bridge: bridge.submit(self.paths, close=True))
+
+        self.assertTrue(finished)
+        self.assertEqual(sorted(result.file.original_path for result in results), sorted(self.paths))
+        self.assertTrue(all(result.status == service.SKIPPED for result in results))
+
+    def test_cancel(self):
+        def submit(bridge):
+            bridge.submit(self.paths)
+            bridge.cancel()
+
+        results, finished = self.run_bridge(submit)
+
+        self.assertTrue(finished)
+        self.assertLessEqual(len(results), len(self.paths))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Tests of the service module, with stand-in worker functions instead of fitz
+and the models, so they run without them.
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+from time import sleep
+from unittest import mock
+
+import deadline
+import extraction
+import file
+import service
+
+
+# Seconds a stuck document would take, far beyond the timeout
+STUCK_SECONDS = 60
+TIMEOUT = 1.5
+# Page ranges of the large document, more than the pool can queue
+RANGE_COUNT = 40
+RANGE_SECONDS = 0.05
+
+
+def fake_extract_pages(path: str) -> str:
+    """
+    Stand-in for `extraction.extract_pages`, run in the worker processes.
+    """
+    sleep(STUCK_SECONDS if path.startswith("stuck") else RANGE_SECONDS)
+    return "page "
+
+
+def fake_submit_document(pool, path: str) -> list:
+    """
+    Stand-in for `extraction.submit_document`: a single range for the stuck
+    documents, many short ranges for the others.
+    """
+    range_count = 1 if path.startswith("stuck") else RANGE_COUNT
+    return [pool.submit(fake_extract_pages, path) for _ in range(range_count)]
+
+
+def fake_join_results(path: str, results: list) -> extraction.ExtractionResult:
+    return extraction.ExtractionResult(path, "".join(results), "")
+
+
+class ExtractTextTimeoutTest(unittest.TestCase):
+    def setUp(self):
+        for patch in (
+            mock.patch.object(extraction, "submit_document", fake_submit_document),
+            mock.patch.object(extraction, "join_results", fake_join_results),
+            mock.patch.object(deadline, "EXTRACTION_TIME_BUDGET", TIMEOUT),
+            mock.patch.object(service, "cpu_count", lambda: 2),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_large_document_survives_the_pool_kill(self):
+        # The large document's ranges still queued when the stuck document
+        # times out are cancelled with the pool, and extracted again
+        async def run():
+            async with service.TrueNameService(max_in_flight=2) as truename:
+                stuck = asyncio.create_task(truename._extract_text("stuck"))
+                await asyncio.sleep(0.2)
+                large = await truename._extract_text("large")
+                return await stuck, large
+
+        stuck, large = asyncio.run(run())
+
+        self.assertTrue(stuck.error.startswith(extraction.TIMEOUT_ERROR))
+        self.assertEqual(large, extraction.ExtractionResult("large", "page " * RANGE_COUNT, ""))
+
+
+class NamedFilesTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def named_file(self, original_name: str, new_name: str) -> file.File:
+        path = os.path.join(self.directory, original_name)
+        with open(path, "wb") as f:
+            f.write(original_name.encode())
+        current_file = file.File(path)
+        current_file.new_name = new_name
+        current_file.build_new_path()
+        return current_file
+
+    def process(self, files: list, rename: bool) -> list:
+        async def run():
+            async with service.TrueNameService(rename=rename) as truename:
+                submitter = asyncio.create_task(truename.submit(files, close=True))
+                results = [result async for result in truename]
+                await submitter
+                return results
+
+        return asyncio.run(run())
+
+    def test_named_files_keep_their_name(self):
+        # A JPEG with such content would fail to decode if it was extracted
+        current_file = self.named_file("a.jpg", "photo.jpg")
+        results = self.process([current_file], rename=False)
+
+        self.assertEqual([(result.status, result.error) for result in results], [(service.NAMED, "")])
+        self.assertEqual(current_file.new_path, os.path.join(self.directory, "photo.jpg"))
+        self.assertFalse(current_file.extracted)
+
+    def test_named_files_are_renamed_with_distinct_names(self):
+        files = [self.named_file(name, "photo.jpg") for name in ("a.jpg", "b.jpg")]
+        results = self.process(files, rename=True)
+
+        self.assertEqual([result.status for result in results], [service.RENAMED] * 2)
+        self.assertEqual(sorted(os.listdir(self.directory)), ["photo.jpg", "photo_(1).jpg"])
+        self.assertEqual(
+            sorted(os.path.basename(current_file.new_path) for current_file in files),
+            ["photo.jpg", "photo_(1).jpg"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()